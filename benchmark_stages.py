@@ -0,0 +1,208 @@
+#!/usr/bin/env python
+
+"""
+Times the dataset preparation stages against the number of samples, on
+synthetic datasets from generate_synthetic_data.py:
+
+- generate: writing the synthetic dataset itself
+- prep_inputs: prep_inputs_for_combiner.py, from the pre-seeded listings
+- ingest_qc: ingest_qc_metrics.py, on the sample map from prep_inputs
+- smk_overlap: prep_warp_inputs.smk up to the overlap of the PED with the
+  listed data, if snakemake is installed
+- families_to_samples: families_to_samples.py against the API stub,
+  without a cache, and again with a warm cache
+
+Each stage runs as a separate process, so the timings include imports.
+For example:
+
+python benchmark_stages.py --samples 1000 --samples 10000 --samples 100000 \
+    --listings-only --report work/benchmark.json
+"""
+
+import functools
+import json
+import logging
+import shutil
+import subprocess
+import sys
+import threading
+import time
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from os.path import abspath, dirname, join
+from typing import List
+
+import click
+
+from generate_synthetic_data import generate
+
+logger = logging.getLogger('benchmark_stages')
+logger.setLevel('INFO')
+
+REPO_DIR = dirname(abspath(__file__))
+DATASET = 'synthetic'
+
+
+class QuietHandler(SimpleHTTPRequestHandler):
+    def log_message(self, *args):  # pylint: disable=arguments-differ
+        pass
+
+
+def serve_api(api_dir: str) -> ThreadingHTTPServer:
+    """
+    Serves the sample-metadata API stub on a free local port
+    """
+    handler = functools.partial(QuietHandler, directory=api_dir)
+    server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def run_stage(results: List[dict], n_samples: int, stage: str, cmd: List[str]):
+    """
+    Runs a stage as a subprocess, recording its wall time
+    """
+    start = time.perf_counter()
+    proc = subprocess.run(
+        cmd, cwd=REPO_DIR, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE
+    )
+    seconds = time.perf_counter() - start
+    if proc.returncode != 0:
+        logger.error(
+            f'{stage} failed for {n_samples} samples:\n{proc.stderr.decode()[-2000:]}'
+        )
+    results.append(dict(
+        stage=stage, samples=n_samples, seconds=seconds, returncode=proc.returncode,
+    ))
+    logger.info(f'{n_samples} samples, {stage}: {seconds:.2f}s')
+
+
+def benchmark(
+    n_samples: int, work_dir: str, listings_only: bool, results: List[dict]
+):
+    """
+    Generates a dataset of n_samples, and times all stages on it
+    """
+    data_dir = join(work_dir, str(n_samples))
+    shutil.rmtree(data_dir, ignore_errors=True)
+    start = time.perf_counter()
+    ped_rows = generate(data_dir, n_samples, listings_only=listings_only)
+    results.append(dict(
+        stage='generate', samples=n_samples,
+        seconds=time.perf_counter() - start, returncode=0,
+    ))
+
+    run_stage(results, n_samples, 'prep_inputs', [
+        sys.executable, 'prep_inputs_for_combiner.py',
+        '--dataset', DATASET,
+        '--ped', join(data_dir, 'samples.ped'),
+        '--datasets-dir', join(data_dir, 'datasets'),
+        '--work-dir', join(data_dir, 'work', 'prep_inputs_for_combiner'),
+        '--split-rounds',
+        '--randomise-pop-labels',
+    ])
+
+    if listings_only:
+        logger.info('Skipping ingest_qc, the QC files were not written')
+    else:
+        run_stage(results, n_samples, 'ingest_qc', [
+            sys.executable, 'ingest_qc_metrics.py',
+            '--dataset', DATASET,
+            '--datasets-dir', join(data_dir, 'datasets'),
+            '--out', join(data_dir, 'qc.parquet'),
+        ])
+
+    if shutil.which('snakemake'):
+        run_stage(results, n_samples, 'smk_overlap', [
+            'snakemake', '-s', join(REPO_DIR, 'prep_warp_inputs.smk'),
+            '--directory', join(data_dir, 'smk'), '-j1',
+            '--config', f'dataset_name={DATASET}', 'input_type=wgs_bam',
+            '--', 'work/g1k-samples-with-gs-data.ped',
+        ])
+    else:
+        logger.info('Skipping smk_overlap, snakemake is not installed')
+
+    server = serve_api(join(data_dir, 'sm-api'))
+    families = sorted({row['Family.ID'] for row in ped_rows})
+    families_cmd = [
+        sys.executable, join('datasets', 'acute-care', 'families_to_samples.py'),
+        '--project', DATASET,
+        '--url-base', f'http://127.0.0.1:{server.server_port}',
+        '--auth', 'synthetic',
+        '--complete-trios',
+    ]
+    for family in families[:: max(1, len(families) // 100)]:
+        families_cmd += ['-f', family]
+    try:
+        run_stage(
+            results, n_samples, 'families_to_samples', families_cmd + ['--no-cache']
+        )
+        cache_cmd = families_cmd + ['--cache-dir', join(data_dir, 'sm-cache')]
+        subprocess.run(cache_cmd, cwd=REPO_DIR, stdout=subprocess.DEVNULL, check=False)
+        run_stage(results, n_samples, 'families_to_samples_cached', cache_cmd)
+    finally:
+        server.shutdown()
+
+
+@click.command()
+@click.option(
+    '--samples',
+    'sample_counts',
+    multiple=True,
+    type=click.INT,
+    default=[1000, 10000],
+    help='Number of samples to benchmark with, can be repeated. '
+         'Default is 1000 and 10000.'
+)
+@click.option(
+    '--work-dir',
+    'work_dir',
+    default=join('work', 'benchmark'),
+    help='Folder for the synthetic datasets. Default is "work/benchmark".'
+)
+@click.option(
+    '--listings-only',
+    'listings_only',
+    is_flag=True,
+    help='Only write listings of the synthetic files. Skips ingest_qc.'
+)
+@click.option(
+    '--report',
+    'report_path',
+    help='Write the timings to this JSON file.'
+)
+def main(sample_counts, work_dir: str, listings_only: bool, report_path: str):
+    """
+    Time the dataset preparation stages against the number of samples
+    """
+    results: List[dict] = []
+    for n_samples in sample_counts:
+        benchmark(n_samples, abspath(work_dir), listings_only, results)
+
+    stages = list(dict.fromkeys(r['stage'] for r in results))
+    print('\t'.join(['stage'] + [str(n) for n in sample_counts]))
+    for stage in stages:
+        row = [stage]
+        for n_samples in sample_counts:
+            result = next(
+                (
+                    r for r in results
+                    if r['stage'] == stage and r['samples'] == n_samples
+                ),
+                None,
+            )
+            if result is None:
+                row.append('')
+            elif result['returncode'] != 0:
+                row.append('failed')
+            else:
+                row.append(f'{result["seconds"]:.2f}')
+        print('\t'.join(row))
+
+    if report_path:
+        with open(report_path, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    logging.basicConfig()
+    main()  # pylint: disable=E1120
@@ -0,0 +1,386 @@
+#!/usr/bin/env python
+
+"""
+Indexes the dataset files (`samples.ped`, `*-wgs_bam.tsv`, `*-local.tsv`,
+`sample-maps/*.csv` and WARP input JSONs) into a single SQLite catalog,
+to look up samples, datasets and paths without grepping through them.
+
+The catalog is refreshed incrementally: a file is only re-parsed when its
+modification time and content hash have both changed.
+"""
+
+import csv
+import glob
+import hashlib
+import json
+import os
+import sqlite3
+from os.path import basename, dirname, join, relpath
+from typing import Iterable, List, Tuple
+
+import click
+
+DEFAULT_DB = join('work', 'catalog.sqlite')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sources (
+    source TEXT PRIMARY KEY,
+    dataset TEXT NOT NULL,
+    mtime REAL NOT NULL,
+    sha1 TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS individuals (
+    sample TEXT NOT NULL,
+    dataset TEXT NOT NULL,
+    family TEXT,
+    population TEXT,
+    source TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS labels (
+    sample TEXT NOT NULL,
+    dataset TEXT NOT NULL,
+    population TEXT,
+    source TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS paths (
+    sample TEXT NOT NULL,
+    dataset TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    path TEXT NOT NULL,
+    source TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS individuals_sample ON individuals (sample);
+CREATE INDEX IF NOT EXISTS individuals_dataset ON individuals (dataset);
+CREATE INDEX IF NOT EXISTS individuals_source ON individuals (source);
+CREATE INDEX IF NOT EXISTS labels_sample ON labels (sample);
+CREATE INDEX IF NOT EXISTS labels_source ON labels (source);
+CREATE INDEX IF NOT EXISTS paths_sample ON paths (sample);
+CREATE INDEX IF NOT EXISTS paths_dataset ON paths (dataset);
+CREATE INDEX IF NOT EXISTS paths_path ON paths (path);
+CREATE INDEX IF NOT EXISTS paths_source ON paths (source);
+"""
+
+# sample map columns which aren't paths
+SAMPLE_MAP_LABEL_COLUMNS = {'sample', 'population'}
+
+
+def connect(db_path: str) -> sqlite3.Connection:
+    if dirname(db_path):
+        os.makedirs(dirname(db_path), exist_ok=True)
+    conn = sqlite3.connect(db_path)
+    conn.executescript(SCHEMA)
+    return conn
+
+
+def find_sources(datasets_dir: str) -> List[str]:
+    """
+    All files indexed by the catalog, for every dataset
+    """
+    patterns = [
+        '*/samples.ped',
+        '*/*.tsv',
+        '*/sample-maps/*.csv',
+        '*/*.json',
+        '*/*/*.json',
+    ]
+    return sorted(
+        path
+        for pattern in patterns
+        for path in glob.glob(join(datasets_dir, pattern))
+    )
+
+
+def file_sha1(path: str) -> str:
+    sha1 = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            sha1.update(chunk)
+    return sha1.hexdigest()
+
+
+def parse_ped(path: str) -> Iterable[Tuple[str, str, str]]:
+    """
+    (sample, family, population) for each individual. Rows may have
+    more fields than the header, so fields are matched by position.
+    """
+    with open(path) as f:
+        reader = csv.reader(f, delimiter='\t')
+        header = next(reader)
+        for fields in reader:
+            row = dict(zip(header, fields))
+            if row.get('Individual.ID'):
+                yield (
+                    row['Individual.ID'], row.get('Family.ID'), row.get('Population')
+                )
+
+
+def parse_tsv(path: str, dataset: str) -> Iterable[Tuple[str, str, str]]:
+    """
+    (sample, kind, path) for a headerless sample<TAB>path file. The kind comes
+    from the file name, e.g. `50genomes-gvcf-gvcf-local.tsv` -> `gvcf-local`
+    """
+    kind = basename(path)[:-len('.tsv')]
+    if kind.startswith(f'{dataset}-'):
+        kind = kind[len(dataset) + 1:]
+    with open(path) as f:
+        for line in f:
+            fields = line.rstrip('\n').split('\t')
+            if len(fields) >= 2 and fields[0]:
+                yield fields[0], kind, fields[1]
+
+
+def parse_sample_map(
+    path: str,
+) -> Tuple[List[Tuple[str, str]], List[Tuple[str, str, str]]]:
+    """
+    Population labels as (sample, population),
+    and paths as (sample, kind, path), with the column name as the kind
+    """
+    labels, paths = [], []
+    with open(path, newline='') as f:
+        for row in csv.DictReader(f):
+            labels.append((row['sample'], row.get('population') or ''))
+            for column, value in row.items():
+                if column not in SAMPLE_MAP_LABEL_COLUMNS and value:
+                    paths.append((row['sample'], column, value))
+    return labels, paths
+
+
+def parse_warp_json(path: str) -> Iterable[Tuple[str, str, str]]:
+    """
+    (sample, kind, path) for the top-level file inputs of a WARP JSON.
+    Single-sample inputs name their sample in `*.sample_name`; for lists of
+    files, the sample is taken from the file name.
+    """
+    with open(path) as f:
+        inputs = json.load(f)
+    sample = next(
+        (v for k, v in inputs.items() if k.endswith('.sample_name')), None
+    )
+    for key, value in inputs.items():
+        kind = 'warp_' + key.split('.')[-1]
+        if sample and isinstance(value, str) and value.startswith('gs://'):
+            yield sample, kind, value
+        elif isinstance(value, list):
+            for item in value:
+                if isinstance(item, str) and item.startswith('gs://'):
+                    yield basename(item).split('.')[0], kind, item
+
+
+def index_source(conn: sqlite3.Connection, path: str, source: str, dataset: str):
+    """
+    Replaces all catalog rows coming from the source file
+    :param path: file to parse
+    :param source: name to record the file under, relative to the datasets folder
+    """
+    for table in ['individuals', 'labels', 'paths']:
+        conn.execute(f'DELETE FROM {table} WHERE source = ?', (source,))
+
+    paths: Iterable[Tuple[str, str, str]] = []
+    if basename(path) == 'samples.ped':
+        conn.executemany(
+            'INSERT INTO individuals VALUES (?, ?, ?, ?, ?)',
+            [(s, dataset, fam, pop, source) for s, fam, pop in parse_ped(path)],
+        )
+    elif path.endswith('.tsv'):
+        paths = parse_tsv(path, dataset)
+    elif path.endswith('.csv'):
+        labels, paths = parse_sample_map(path)
+        conn.executemany(
+            'INSERT INTO labels VALUES (?, ?, ?, ?)',
+            [(s, dataset, pop, source) for s, pop in labels],
+        )
+    elif path.endswith('.json'):
+        paths = parse_warp_json(path)
+    conn.executemany(
+        'INSERT INTO paths VALUES (?, ?, ?, ?, ?)',
+        [(s, dataset, kind, p, source) for s, kind, p in paths],
+    )
+
+
+def refresh(conn: sqlite3.Connection, datasets_dir: str) -> Tuple[int, int]:
+    """
+    Re-indexes files which changed since the last refresh,
+    and drops files which no longer exist
+    :return: number of re-indexed and dropped files
+    """
+    known = {
+        source: (mtime, sha1)
+        for source, mtime, sha1 in conn.execute(
+            'SELECT source, mtime, sha1 FROM sources'
+        )
+    }
+    found = find_sources(datasets_dir)
+    n_indexed = 0
+    with conn:
+        for path in found:
+            source = relpath(path, datasets_dir)
+            dataset = source.split(os.sep)[0]
+            mtime = os.path.getmtime(path)
+            if source in known and known[source][0] == mtime:
+                continue
+            sha1 = file_sha1(path)
+            if source not in known or known[source][1] != sha1:
+                index_source(conn, path, source, dataset)
+                n_indexed += 1
+            conn.execute(
+                'INSERT OR REPLACE INTO sources VALUES (?, ?, ?, ?)',
+                (source, dataset, mtime, sha1),
+            )
+
+        gone = set(known) - {relpath(path, datasets_dir) for path in found}
+        for source in gone:
+            for table in ['sources', 'individuals', 'labels', 'paths']:
+                conn.execute(f'DELETE FROM {table} WHERE source = ?', (source,))
+    return n_indexed, len(gone)
+
+
+def blanked_labels(conn: sqlite3.Connection, dataset: str = None) -> List[tuple]:
+    """
+    Samples with an empty population in a sample map, while the PED file of
+    the same dataset has one, i.e. labels blanked by --randomise-pop-labels
+    """
+    query = """
+        SELECT DISTINCT l.dataset, l.sample, i.population, l.source
+        FROM labels l JOIN individuals i
+        ON l.sample = i.sample AND l.dataset = i.dataset
+        WHERE l.population = '' AND i.population != ''
+    """
+    params: tuple = ()
+    if dataset:
+        query += ' AND l.dataset = ?'
+        params = (dataset,)
+    return conn.execute(query + ' ORDER BY 1, 2, 4', params).fetchall()
+
+
+def print_rows(rows: List[tuple]):
+    for row in rows:
+        print('\t'.join('' if value is None else str(value) for value in row))
+
+
+@click.group()
+@click.option(
+    '--db',
+    'db_path',
+    default=DEFAULT_DB,
+    help=f'Catalog database. Default is "{DEFAULT_DB}".'
+)
+@click.option(
+    '--datasets-dir',
+    'datasets_dir',
+    default='datasets',
+    help='Datasets folder. Default is "datasets/".'
+)
+@click.option(
+    '--refresh/--no-refresh',
+    'do_refresh',
+    default=False,
+    help='Refresh the catalog before a query.'
+)
+@click.pass_context
+def cli(ctx, db_path: str, datasets_dir: str, do_refresh: bool):
+    """
+    Catalog of samples, datasets and paths
+    """
+    ctx.obj = connect(db_path)
+    if do_refresh and ctx.invoked_subcommand != 'refresh':
+        refresh(ctx.obj, datasets_dir)
+    ctx.call_on_close(ctx.obj.close)
+    ctx.meta['datasets_dir'] = datasets_dir
+
+
+@cli.command('refresh')
+@click.pass_context
+def refresh_cmd(ctx):
+    """
+    Index new and changed dataset files
+    """
+    n_indexed, n_dropped = refresh(ctx.obj, ctx.meta['datasets_dir'])
+    print(f'Indexed {n_indexed} changed files, dropped {n_dropped} removed files')
+
+
+@cli.command('sample')
+@click.argument('sample')
+@click.pass_obj
+def sample_cmd(conn, sample: str):
+    """
+    Datasets, families, population labels and paths of a sample
+    """
+    print_rows(conn.execute(
+        """
+        SELECT dataset, 'family', family, source FROM individuals WHERE sample = ?
+        UNION ALL
+        SELECT dataset, 'population', population, source FROM individuals
+        WHERE sample = ?
+        UNION ALL
+        SELECT dataset, 'label', population, source FROM labels WHERE sample = ?
+        UNION ALL
+        SELECT dataset, kind, path, source FROM paths WHERE sample = ?
+        ORDER BY 1, 2, 4
+        """,
+        (sample, sample, sample, sample),
+    ).fetchall())
+
+
+@cli.command('dataset')
+@click.argument('dataset')
+@click.pass_obj
+def dataset_cmd(conn, dataset: str):
+    """
+    Samples of a dataset, with their population and number of paths
+    """
+    print_rows(conn.execute(
+        """
+        SELECT s.sample, i.family, i.population, COUNT(DISTINCT p.path)
+        FROM (
+            SELECT sample FROM individuals WHERE dataset = ?
+            UNION SELECT sample FROM paths WHERE dataset = ?
+        ) s
+        LEFT JOIN individuals i ON i.sample = s.sample AND i.dataset = ?
+        LEFT JOIN paths p ON p.sample = s.sample AND p.dataset = ?
+        GROUP BY s.sample ORDER BY s.sample
+        """,
+        (dataset, dataset, dataset, dataset),
+    ).fetchall())
+
+
+@cli.command('path')
+@click.argument('path')
+@click.option(
+    '--prefix',
+    'is_prefix',
+    is_flag=True,
+    help='Match all paths starting with PATH.'
+)
+@click.pass_obj
+def path_cmd(conn, path: str, is_prefix: bool):
+    """
+    Samples and datasets a path (or path prefix) maps to
+    """
+    if is_prefix:
+        # a range scan, so the lookup uses the index
+        rows = conn.execute(
+            'SELECT sample, dataset, kind, path, source FROM paths '
+            'WHERE path >= ? AND path < ? ORDER BY path',
+            (path, path + '\U0010ffff'),
+        ).fetchall()
+    else:
+        rows = conn.execute(
+            'SELECT sample, dataset, kind, path, source FROM paths WHERE path = ?',
+            (path,),
+        ).fetchall()
+    print_rows(rows)
+
+
+@cli.command('blanked')
+@click.option('--dataset', 'dataset', help='Only report this dataset.')
+@click.pass_obj
+def blanked_cmd(conn, dataset: str):
+    """
+    Population labels blanked in sample maps
+    """
+    print_rows(blanked_labels(conn, dataset))
+
+
+if __name__ == '__main__':
+    cli()  # pylint: disable=E1120
@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+
+"""
+Checks the start-up cost of the entry point scripts, using `python -X importtime`.
+
+Each script is run with --help, which shouldn't need any heavy module.
+A script fails the check if its imports take longer than the budget, or if it
+imports any of HEAVY_MODULES at all, which doesn't depend on the machine speed.
+Modules imported by the interpreter itself before the script runs are not counted.
+"""
+
+import subprocess
+import sys
+from os.path import abspath, dirname
+from typing import List, Optional, Tuple
+
+import click
+
+REPO_DIR = dirname(abspath(__file__))
+
+ENTRY_POINTS = [
+    'prep_inputs_for_combiner.py',
+    'hail_subset_gnomad.py',
+    'datasets/acute-care/extract_trio_vcf.py',
+    'datasets/acute-care/families_to_samples.py',
+]
+HEAVY_MODULES = [
+    'hail',
+    'pyspark',
+    'pandas',
+    'numpy',
+    'google.cloud.storage',
+    'requests',
+]
+DEFAULT_BUDGET_MS = 250
+
+
+def run_importtime(args: List[str]) -> Tuple[List[Tuple[int, int, str]], str]:
+    """
+    Runs python -X importtime with the arguments
+    :return: (self microseconds, cumulative microseconds, module) for top-level
+        imports, in import order, and the last line of the error output if the
+        command failed, or an empty string
+    """
+    proc = subprocess.run(
+        [sys.executable, '-X', 'importtime'] + args,
+        cwd=REPO_DIR,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        check=False,
+    )
+    imports = []
+    errors = []
+    for line in proc.stderr.decode().splitlines():
+        if not line.startswith('import time:'):
+            errors.append(line)
+            continue
+        fields = line[len('import time:'):].split('|')
+        if len(fields) != 3 or not fields[0].strip().isdigit():
+            continue  # the header line
+        imports.append((int(fields[0]), int(fields[1]), fields[2].rstrip()))
+    if proc.returncode == 0:
+        return imports, ''
+    return imports, errors[-1] if errors else f'exit code {proc.returncode}'
+
+
+def check_entry_point(
+    script: str, baseline: set, budget_ms: float
+) -> Tuple[bool, float, List[str], List[Tuple[int, str]], str]:
+    """
+    A script that fails to run with --help fails the check, as its import
+    time would otherwise only cover the imports before the error
+    :return: whether the script passes, its import time in ms, the heavy
+        modules it imported, its slowest top-level imports, and the error
+        if it failed to run
+    """
+    imports, error = run_importtime([script, '--help'])
+    top_level = [
+        (cumulative, name.strip())
+        for _, cumulative, name in imports
+        if not name.startswith('  ') and name.strip() not in baseline
+    ]
+    total_ms = sum(cumulative for cumulative, _ in top_level) / 1000
+    loaded = {name.strip() for _, _, name in imports}
+    heavy = [module for module in HEAVY_MODULES if module in loaded]
+    slowest = sorted(top_level, reverse=True)[:3]
+    passed = total_ms <= budget_ms and not heavy and not error
+    return passed, total_ms, heavy, slowest, error
+
+
+@click.command()
+@click.argument('scripts', nargs=-1)
+@click.option(
+    '--budget-ms',
+    'budget_ms',
+    default=DEFAULT_BUDGET_MS,
+    type=click.FLOAT,
+    help=f'Import time budget of each script. Default is {DEFAULT_BUDGET_MS}ms.'
+)
+def main(scripts: Optional[List[str]], budget_ms: float):
+    """
+    Check the import time of SCRIPTS (default: all entry points)
+    """
+    imports, _ = run_importtime(['-c', 'pass'])
+    baseline = {name.strip() for _, _, name in imports}
+    n_failed = 0
+    for script in scripts or ENTRY_POINTS:
+        passed, total_ms, heavy, slowest, error = check_entry_point(
+            script, baseline, budget_ms
+        )
+        n_failed += not passed
+        slowest_str = ', '.join(f'{name} {us / 1000:.0f}ms' for us, name in slowest)
+        print(
+            f'{"ok" if passed else "FAILED"}\t{total_ms:.0f}ms\t{script}\t'
+            f'slowest: {slowest_str}'
+            + (f'\theavy modules: {", ".join(heavy)}' if heavy else '')
+            + (f'\terror: {error}' if error else '')
+        )
+    print(f'Checked {len(scripts or ENTRY_POINTS)} scripts, {n_failed} failed')
+    sys.exit(1 if n_failed else 0)
+
+
+if __name__ == '__main__':
+    main()  # pylint: disable=E1120
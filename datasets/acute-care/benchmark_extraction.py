@@ -0,0 +1,233 @@
+#!/usr/bin/env python3
+
+
+"""
+Benchmarks the runtime of extracting families from a cohort MT, comparing
+the extraction strategies used in extract_trio_vcf.py
+
+- per_family: every family is subset from the full cohort MT (the original approach)
+- checkpoint: all requested samples are checkpointed once, families derived from that
+- fan_out: as checkpoint, with all family MTs written in a single pass
+
+Synthetic cohorts are generated on Hail's local backend, at one or more
+scales given as 'samples,variants,families', e.g.
+
+python3 benchmark_extraction.py --scale 100,10000,10 --scale 1000,100000,50
+
+Timings for each stage are written to a JSON report, to compare across releases
+"""
+
+
+import json
+import logging
+import os
+import shutil
+import sys
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+import click
+import hail as hl
+
+from extract_trio_vcf import (
+    SAMPLE_CACHE_SUFFIX,
+    check_samples_present,
+    checkpoint_subset,
+    get_all_unique_members,
+    get_mt_samples,
+    obtain_mt_subset,
+    write_family_mts,
+)
+
+
+STRATEGIES = ['per_family', 'checkpoint', 'fan_out']
+
+
+@contextmanager
+def timed(results: list, scale: dict, strategy: str, stage: str):
+    """
+    records the wall time of the wrapped block as a single result row
+    """
+    start = time.perf_counter()
+    yield
+    seconds = time.perf_counter() - start
+    results.append(dict(scale, strategy=strategy, stage=stage, seconds=seconds))
+    logging.info('%s %s %s: %.2fs', scale, strategy, stage, seconds)
+
+
+def parse_scale(scale: str) -> dict:
+    """
+    parses a 'samples,variants,families' string
+    """
+    n_samples, n_variants, n_families = (int(value) for value in scale.split(','))
+    if n_families * 3 > n_samples:
+        raise click.BadParameter(f'{scale}: not enough samples for {n_families} trios')
+    return {'samples': n_samples, 'variants': n_variants, 'families': n_families}
+
+
+def make_synthetic_cohort(
+    n_samples: int, n_variants: int, path: str, n_partitions: int = None
+) -> hl.MatrixTable:
+    """
+    writes a synthetic cohort MT with string sample IDs and VCF-like entries
+    """
+    mt = hl.balding_nichols_model(
+        n_populations=3,
+        n_samples=n_samples,
+        n_variants=n_variants,
+        n_partitions=n_partitions,
+    )
+    mt = mt.annotate_cols(s=hl.str('SYN') + hl.str(mt.sample_idx))
+    mt = mt.key_cols_by('s').drop('sample_idx')
+    mt = mt.select_rows()
+    mt = mt.annotate_entries(DP=hl.rand_int32(10, 60), GQ=hl.rand_int32(0, 99))
+    ref_depth = (
+        hl.case()
+        .when(mt.GT.is_hom_ref(), mt.DP)
+        .when(mt.GT.is_hom_var(), 0)
+        .default(mt.DP // 2)
+    )
+    mt = mt.annotate_entries(AD=[ref_depth, mt.DP - ref_depth])
+    mt.write(path, overwrite=True)
+    return hl.read_matrix_table(path)
+
+
+def make_families(samples: list, n_families: int) -> dict:
+    """
+    groups consecutive samples into trios
+    """
+    return {
+        f'FAM{index}': samples[index * 3 : index * 3 + 3]
+        for index in range(n_families)
+    }
+
+
+def run_strategy(
+    strategy: str,
+    cohort_path: str,
+    families: dict,
+    output_dir: str,
+    scale: dict,
+    results: list,
+):
+    """
+    runs a single extraction strategy, timing each stage
+    """
+    all_samples = get_all_unique_members(families)
+    mt = hl.read_matrix_table(cohort_path)
+
+    # validate both without and with the sample ID cache in place
+    if os.path.exists(cohort_path + SAMPLE_CACHE_SUFFIX):
+        os.remove(cohort_path + SAMPLE_CACHE_SUFFIX)
+    with timed(results, scale, strategy, 'validate'):
+        check_samples_present(all_samples, families, get_mt_samples(cohort_path))
+    with timed(results, scale, strategy, 'validate_cached'):
+        check_samples_present(all_samples, families, get_mt_samples(cohort_path))
+
+    source = mt
+    if strategy != 'per_family':
+        with timed(results, scale, strategy, 'subset'):
+            source = checkpoint_subset(
+                mt, list(all_samples), os.path.join(output_dir, 'multiple_families.mt')
+            )
+
+    family_mts = {
+        family: obtain_mt_subset(source, samples)
+        for family, samples in families.items()
+    }
+
+    with timed(results, scale, strategy, 'mt_write'):
+        if strategy == 'fan_out':
+            write_family_mts(family_mts, output_dir)
+        else:
+            for family, family_mt in family_mts.items():
+                family_mt.write(
+                    os.path.join(output_dir, f'{family}.mt'), overwrite=True
+                )
+
+    with timed(results, scale, strategy, 'vcf_export'):
+        for family, family_mt in family_mts.items():
+            hl.export_vcf(family_mt, os.path.join(output_dir, f'{family}.vcf.bgz'))
+
+
+@click.command()
+@click.option(
+    '--scale',
+    'scales',
+    multiple=True,
+    default=['100,10000,10'],
+    type=click.STRING,
+    help='synthetic cohort scale as samples,variants,families (repeatable)',
+)
+@click.option(
+    '--strategy',
+    'strategies',
+    multiple=True,
+    default=STRATEGIES,
+    type=click.Choice(STRATEGIES),
+    help='extraction strategies to benchmark (default: all)',
+)
+@click.option(
+    '--partitions',
+    'n_partitions',
+    default=None,
+    type=click.INT,
+    help='number of partitions in the synthetic cohort MT',
+)
+@click.option(
+    '--work-dir',
+    'work_dir',
+    default='work/benchmark_extraction',
+    help='local directory for synthetic cohorts and extraction outputs',
+)
+@click.option(
+    '--report',
+    'report_path',
+    default='benchmark_extraction.json',
+    help='path to write the JSON report to',
+)
+def main(scales, strategies, n_partitions, work_dir, report_path):
+    """
+    generates each synthetic cohort, then times each strategy against it
+    """
+    hl.init(default_reference='GRCh38')
+
+    results = []  # type: ignore
+    for scale_str in scales:
+        scale = parse_scale(scale_str)
+        scale_dir = os.path.join(
+            work_dir, '{samples}x{variants}x{families}'.format(**scale)
+        )
+        cohort_path = os.path.join(scale_dir, 'cohort.mt')
+
+        with timed(results, scale, 'setup', 'generate'):
+            cohort = make_synthetic_cohort(
+                scale['samples'], scale['variants'], cohort_path, n_partitions
+            )
+        families = make_families(cohort.s.collect(), scale['families'])
+
+        for strategy in strategies:
+            output_dir = os.path.join(scale_dir, strategy)
+            shutil.rmtree(output_dir, ignore_errors=True)
+            os.makedirs(output_dir)
+            run_strategy(strategy, cohort_path, families, output_dir, scale, results)
+
+    report = {
+        'created': datetime.now().isoformat(),
+        'hail_version': hl.version(),
+        'results': results,
+    }
+    with open(report_path, 'w') as handle:
+        json.dump(report, handle, indent=4)
+    logging.info('Report written to %s', report_path)
+
+
+if __name__ == '__main__':
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s %(levelname)s %(module)s:%(lineno)d - %(message)s',
+        datefmt='%Y-%m-%d %H:%M:%S',
+        stream=sys.stderr,
+    )
+    main()  # pylint: disable=E1120
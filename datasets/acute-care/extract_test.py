@@ -1,4 +1,5 @@
 import hail as hl
+import json
 import logging
 import os
 import pytest
@@ -6,9 +7,19 @@ import re
 
 # import the local methods
 from extract_trio_vcf import (
+    SAMPLE_CACHE_SUFFIX,
     check_samples_in_mt,
+    check_samples_present,
+    checkpoint_subset,
+    drop_cohort_annotations,
+    extraction_output_dir,
+    filter_to_variant_rows,
     get_all_unique_members,
+    get_mt_samples,
     obtain_mt_subset,
+    slim_mt,
+    write_family_mts,
+    write_output_index,
     NotAllSamplesPresent,
 )
 
@@ -26,6 +37,7 @@ The VCF also contains only one variant
 CURDIR = os.path.dirname(os.path.abspath(__file__))
 VCF_PATH = os.path.join(CURDIR, "1kg.vcf.bgz")
 MT_PATH = os.path.join(CURDIR, "test_input.mt")
+OUTPUT_DIR = os.path.join(CURDIR, "test_output")
 
 
 @pytest.fixture()
@@ -67,6 +79,13 @@ def test_chain(zero_family_dict: dict):
     assert sorted(result) == ["all", "are", "missing", "samples"]
 
 
+def test_extraction_output_dir():
+    assert (
+        extraction_output_dir("acute-care", "run1")
+        == "gs://cpg-acute-care-test/extractions/run1"
+    )
+
+
 class TestMT:
     """
     all tests requiring the mt to be loaded
@@ -86,6 +105,9 @@ class TestMT:
         import shutil
 
         shutil.rmtree(MT_PATH)
+        shutil.rmtree(OUTPUT_DIR, ignore_errors=True)
+        if os.path.exists(MT_PATH + SAMPLE_CACHE_SUFFIX):
+            os.remove(MT_PATH + SAMPLE_CACHE_SUFFIX)
         for path in os.listdir(CURDIR):
             if re.match(r"hail.*\.log", path):
                 os.remove(path)
@@ -128,6 +150,24 @@ class TestMT:
             mat=self.mt,
         )
 
+    def test_mt_samples_cached(self):
+        expected = {"HG00607", "HG00619", "HG00623", "HG00657"}
+        assert get_mt_samples(MT_PATH) == expected
+        assert os.path.exists(MT_PATH + SAMPLE_CACHE_SUFFIX)
+        # second lookup is served from the cache
+        assert get_mt_samples(MT_PATH) == expected
+
+    def test_partial_failure_from_set(self, caplog, partial_family_dict):
+        caplog.set_level(logging.INFO)
+        all_samples = {"HG00607", "HG00619", "HG00623", "HG00657", "not", "present"}
+        with pytest.raises(NotAllSamplesPresent):
+            check_samples_present(
+                sample_names=all_samples,
+                family_structures=partial_family_dict,
+                samples_in_mt=get_mt_samples(MT_PATH),
+            )
+        assert "Samples missing: ['not', 'present']" in caplog.text
+
     def test_obtain_subset(self):
         selected_samples = {"HG00607", "HG00619"}
         mt_result = obtain_mt_subset(self.mt, selected_samples)
@@ -142,3 +182,101 @@ class TestMT:
         mt_result = obtain_mt_subset(self.mt, selected_samples)
         result_samples = mt_result.s.collect()
         assert set(result_samples) != selected_samples
+
+    def test_checkpoint_subset(self):
+        selected_samples = ["HG00607", "HG00619", "HG00623"]
+        mt_result = checkpoint_subset(
+            self.mt, selected_samples, os.path.join(OUTPUT_DIR, "checkpoint.mt")
+        )
+        assert set(mt_result.s.collect()) == set(selected_samples)
+        assert mt_result.count_rows() == self.mt.count_rows()
+
+    def test_write_family_mts(self, complete_family_dict: dict):
+        family_mts = {
+            family: obtain_mt_subset(self.mt, samples)
+            for family, samples in complete_family_dict.items()
+        }
+        family_paths = write_family_mts(family_mts, OUTPUT_DIR)
+        assert sorted(family_paths) == ["fam1", "fam2"]
+        for family, path in family_paths.items():
+            result_samples = hl.read_matrix_table(path).s.collect()
+            assert set(result_samples) == set(complete_family_dict[family])
+
+    def test_write_family_mts_padded_names(self):
+        """
+        from 11 outputs on, hail zero-pads the index in the MT names
+        """
+        family_mts = {
+            f"fam{index}": obtain_mt_subset(self.mt, ["HG00607"])
+            for index in range(11)
+        }
+        family_paths = write_family_mts(
+            family_mts, os.path.join(OUTPUT_DIR, "padded")
+        )
+        assert family_paths["fam0"].endswith("00.mt")
+        assert family_paths["fam10"].endswith("10.mt")
+        for path in family_paths.values():
+            assert hl.read_matrix_table(path).s.collect() == ["HG00607"]
+
+    def test_write_output_index(self):
+        outputs = {
+            "fam1": {"mt": os.path.join(OUTPUT_DIR, "families", "0.mt")},
+            "fam2": {"vcf": os.path.join(OUTPUT_DIR, "fam2.vcf.bgz")},
+        }
+        os.makedirs(OUTPUT_DIR, exist_ok=True)
+        index_path = write_output_index(outputs, OUTPUT_DIR)
+        assert index_path == os.path.join(OUTPUT_DIR, "families.json")
+        with open(index_path) as handle:
+            assert json.load(handle) == outputs
+
+    def test_filter_to_variant_rows(self):
+        """
+        the single variant is hom-ref or missing in every sample
+        """
+        assert filter_to_variant_rows(self.mt).count_rows() == 0
+
+    def test_filter_to_variant_rows_het(self):
+        """
+        the variant is kept once a single sample carries it
+        """
+        mt = self.mt.annotate_entries(
+            GT=hl.if_else(self.mt.s == "HG00607", hl.call(0, 1), self.mt.GT)
+        )
+        assert filter_to_variant_rows(mt).count_rows() == 1
+        assert filter_to_variant_rows(
+            obtain_mt_subset(mt, ["HG00619", "HG00623"])
+        ).count_rows() == 0
+
+    def test_checkpoint_subset_variants_only(self):
+        mt_result = checkpoint_subset(
+            self.mt,
+            ["HG00607", "HG00619"],
+            os.path.join(OUTPUT_DIR, "variants_only.mt"),
+            variants_only=True,
+        )
+        assert mt_result.count_rows() == 0
+
+    def test_checkpoint_subset_variants_only_het(self):
+        mt = self.mt.annotate_entries(
+            GT=hl.if_else(self.mt.s == "HG00607", hl.call(0, 1), self.mt.GT)
+        )
+        mt_result = checkpoint_subset(
+            mt,
+            ["HG00607", "HG00619"],
+            os.path.join(OUTPUT_DIR, "variants_only_het.mt"),
+            variants_only=True,
+        )
+        assert mt_result.count_rows() == 1
+
+    def test_slim_mt(self, caplog):
+        caplog.set_level(logging.INFO)
+        mt_result = slim_mt(self.mt, ["GT", "DP", "NotAField"])
+        assert list(mt_result.entry) == ["GT", "DP"]
+        assert "info" in mt_result.row
+        assert "Entry fields not present in the MT: ['NotAField']" in caplog.text
+
+    def test_drop_cohort_annotations(self):
+        mt_result = drop_cohort_annotations(self.mt)
+        assert "info" not in mt_result.row
+        assert "rsid" in mt_result.row
+        assert list(mt_result.entry) == list(self.mt.entry)
@@ -12,10 +12,21 @@ import json
 import logging
 import os
 import sys
+import uuid
+from datetime import datetime
 from itertools import chain
-from typing import Optional
+from typing import TYPE_CHECKING, Optional
 import click
-import hail as hl
+
+# hail takes seconds to import, so it's only imported by the functions using it,
+# and --help or a malformed --json-str fail fast
+if TYPE_CHECKING:
+    import hail as hl
+
+SAMPLE_CACHE_SUFFIX = '.samples.json'
+
+# row fields which populate the fixed VCF columns, rather than the cohort-level INFO
+VCF_ROW_FIELDS = ['rsid', 'qual', 'filters']
 
 
 class NotAllSamplesPresent(Exception):
@@ -26,7 +37,18 @@ class NotAllSamplesPresent(Exception):
 
 
 def check_samples_in_mt(
-    sample_names: set, family_structures: dict, mat: hl.MatrixTable
+    sample_names: set, family_structures: dict, mat: 'hl.MatrixTable'
+):
+    """
+    checks if all samples are present in the MT, reading only the column table
+    """
+    check_samples_present(
+        sample_names, family_structures, set(mat.cols().s.collect())
+    )
+
+
+def check_samples_present(
+    sample_names: set, family_structures: dict, samples_in_mt: set
 ):
     """
     checks if all samples are present
@@ -37,8 +59,6 @@ def check_samples_in_mt(
 
     could restructure this so that we only check for absence, with the 'good' case being no errors
     """
-    samples_in_mt = set(mat.s.collect())
-
     if len(sample_names - samples_in_mt) == 0:
         logging.info(
             'All %d samples represented across %d families',
@@ -75,27 +95,166 @@ def get_all_unique_members(family_dict: dict) -> set:
     return set(chain.from_iterable(family_dict.values()))
 
 
-def read_mt(mt_location: str, reference: Optional[str] = 'GRCh38') -> hl.MatrixTable:
+def get_mt_samples(mt_location: str) -> set:
     """
-    read the requested MT using the provided reference
+    obtains all sample IDs in the MT, reading only the column table
+
+    the IDs are cached beside the MT, keyed on the size and modification time of
+    the MT metadata, so repeat lookups don't start a Spark job
     """
+    import hail as hl
 
-    # initiate Hail expecting GRCh38
-    hl.init(default_reference=reference)
+    cache_path = f'{mt_location.rstrip("/")}{SAMPLE_CACHE_SUFFIX}'
+    metadata = hl.hadoop_stat(os.path.join(mt_location, 'metadata.json.gz'))
+    cache_key = {
+        'size_bytes': metadata['size_bytes'],
+        'modification_time': metadata['modification_time'],
+    }
+
+    if hl.hadoop_exists(cache_path):
+        with hl.hadoop_open(cache_path) as handle:
+            cached = json.load(handle)
+        if cached.get('key') == cache_key:
+            return set(cached['samples'])
+
+    samples = hl.read_matrix_table(mt_location).cols().s.collect()
+
+    # the cache is an optimisation, failing to write it shouldn't stop the extraction
+    try:
+        with hl.hadoop_open(cache_path, 'w') as handle:
+            json.dump({'key': cache_key, 'samples': sorted(samples)}, handle)
+    except Exception:  # pylint: disable=broad-except
+        logging.warning('Unable to write the sample ID cache to %s', cache_path)
+
+    return set(samples)
+
+
+def read_mt(mt_location: str) -> 'hl.MatrixTable':
+    """
+    read the requested MT
+    """
+    import hail as hl
 
     # open full MT (note, not all read in, this is done lazily with spark)
     return hl.read_matrix_table(mt_location)
 
 
-def obtain_mt_subset(matrix: hl.MatrixTable, samples: list) -> hl.MatrixTable:
+def obtain_mt_subset(matrix: 'hl.MatrixTable', samples: list) -> 'hl.MatrixTable':
     """
     implements the actual subsetting of the MT
     """
+    import hail as hl
 
     # filter the full dataset to only the samples we're interested in
     return matrix.filter_cols(hl.literal(samples).contains(matrix['s']))
 
 
+def filter_to_variant_rows(matrix: 'hl.MatrixTable') -> 'hl.MatrixTable':
+    """
+    drops all rows where no sample in the MT carries a non-reference allele
+    """
+    import hail as hl
+
+    return matrix.filter_rows(hl.agg.any(matrix.GT.is_non_ref()))
+
+
+def slim_mt(matrix: 'hl.MatrixTable', entry_fields: list) -> 'hl.MatrixTable':
+    """
+    projects the entries down to the requested fields
+    row annotations (e.g. info, VCF annotations) are kept for downstream analysis
+    """
+    missing_fields = [field for field in entry_fields if field not in matrix.entry]
+    if missing_fields:
+        logging.warning('Entry fields not present in the MT: %s', missing_fields)
+
+    return matrix.select_entries(
+        *[field for field in entry_fields if field in matrix.entry]
+    )
+
+
+def drop_cohort_annotations(matrix: 'hl.MatrixTable') -> 'hl.MatrixTable':
+    """
+    drops all the cohort-level row, column and global annotations
+    row fields which populate the fixed VCF columns are retained
+    """
+    return (
+        matrix.select_rows(
+            *[field for field in VCF_ROW_FIELDS if field in matrix.row_value]
+        )
+        .select_cols()
+        .select_globals()
+    )
+
+
+def checkpoint_subset(
+    matrix: 'hl.MatrixTable', samples: list, path: str, variants_only: bool = False
+) -> 'hl.MatrixTable':
+    """
+    subsets the MT to all requested samples and checkpoints the result
+
+    this is the only step which scans the full cohort MT, every family
+    subset is then derived from the much smaller checkpointed MT
+    if variants_only, rows non-variant across all requested samples are dropped
+    """
+    subset = obtain_mt_subset(matrix, samples)
+    if variants_only:
+        subset = filter_to_variant_rows(subset)
+    return subset.checkpoint(path, overwrite=True)
+
+
+def extraction_output_dir(dataset: str, run_id: str) -> str:
+    """
+    every extraction writes into its own folder of the test bucket, so a run
+    never overwrites or mixes with the outputs of another
+    """
+    return os.path.join(f'gs://cpg-{dataset}-test', 'extractions', run_id)
+
+
+def new_run_id() -> str:
+    """
+    a sortable, unique name for a run's output folder
+    """
+    return f'{datetime.now().strftime("%Y%m%dT%H%M%S")}-{uuid.uuid4().hex[:8]}'
+
+
+def write_family_mts(family_mts: dict, output_dir: str) -> dict:
+    """
+    writes all family MTs in a single pass over the source MT
+    hail names multi-write outputs by their zero-padded index, so the paths are
+    taken from what it returns, see write_output_index
+    :param family_mts: dict, family name: family MatrixTable
+    :param output_dir: str, location to write all outputs into
+    :return: dict, family name: path of the written MT
+    """
+    import hail as hl
+
+    families = list(family_mts.keys())
+    prefix = os.path.join(output_dir, 'families', '')
+
+    paths = hl.experimental.write_matrix_tables(
+        [family_mts[family] for family in families], prefix, overwrite=True
+    )
+
+    return dict(zip(families, paths))
+
+
+def write_output_index(outputs: dict, output_dir: str) -> str:
+    """
+    writes families.json, mapping each family to the paths of its outputs
+    this is the one record of where outputs are, however they were written
+    :param outputs: dict, family name: {'mt': path, 'vcf': path} for each
+        output written
+    :param output_dir: str, the run's output folder
+    :return: str, path of the index
+    """
+    import hail as hl
+
+    index_path = os.path.join(output_dir, 'families.json')
+    with hl.hadoop_open(index_path, 'w') as handle:
+        json.dump(outputs, handle, indent=4)
+    return index_path
+
+
 @click.command()
 @click.option(
     '--json-str',
@@ -133,6 +292,41 @@ def obtain_mt_subset(matrix: hl.MatrixTable, samples: list) -> hl.MatrixTable:
     default=False,
     help='use to skip the writing of subset VCF files',
 )
+@click.option(
+    '--run_id',
+    'run_id',
+    default=None,
+    type=click.STRING,
+    help='name of the output folder in the test bucket (default: timestamp-based)',
+)
+@click.option(
+    '--fan_out_min',
+    'fan_out_min',
+    default=10,
+    type=click.INT,
+    help='minimum number of families at which all family MTs are written in one pass',
+)
+@click.option(
+    '--variants_only',
+    'variants_only',
+    is_flag=True,
+    default=False,
+    help='use to drop rows where no member of the family carries an alt allele',
+)
+@click.option(
+    '--entry_fields',
+    'entry_fields',
+    default=None,
+    type=click.STRING,
+    help='comma separated entry fields to retain, e.g. GT,AD,DP,GQ (default: all)',
+)
+@click.option(
+    '--drop_annotations',
+    'drop_annotations',
+    is_flag=True,
+    default=False,
+    help='use to drop cohort-level row (e.g. info), column and global annotations',
+)
 def main(
     json_str: str,
     dataset: str,
@@ -140,6 +334,11 @@ def main(
     multi_fam: bool,
     skip_mt: bool,
     skip_vcf: bool,
+    run_id: Optional[str],
+    fan_out_min: int,
+    variants_only: bool,
+    entry_fields: Optional[str],
+    drop_annotations: bool,
 ):
     """
     This takes the family structures encoded in the JSON str and creates a number
@@ -151,12 +350,26 @@ def main(
     and without extracting from a larger dataset first
 
     Additional options permit the skipping of either the VCF or MT for each family subset
+
+    The cohort MT is scanned once, to checkpoint a subset containing all requested
+    samples, and every family output is derived from that checkpoint. With at least
+    `fan_out_min` families, all family MTs are written together in a single pass
+
+    All outputs of a run are written to gs://cpg-{dataset}-test/extractions/{run_id}/,
+    where families.json maps each family to the paths of its MT and VCF
+
+    Outputs can be slimmed to the variant rows within each family, and to a chosen
+    set of entry fields, e.g. `--variants_only --entry_fields GT,AD,DP,GQ`.
+    Row annotations such as info are kept unless `--drop_annotations` is used
     """
 
     # parse the families dict from the input string, e.g. '{'fam1':['sam1','sam2']}'
     families_dict = json.loads(json_str)
 
-    gcp_test_bucket = f'gs://cpg-{dataset}-test'
+    import hail as hl
+
+    output_dir = extraction_output_dir(dataset, run_id or new_run_id())
+    logging.info('Writing outputs to %s', output_dir)
 
     # path built in this way to pass separate components to the GCP file check
     gcp_main_bucket = f'gs://cpg-{dataset}-main'
@@ -166,34 +379,63 @@ def main(
     # collect all unique sample IDs for a single filter on the MT
     all_samples = get_all_unique_members(families_dict)
 
-    mt = read_mt(gcp_mt_full, reference=reference)
+    # initiate Hail expecting the requested reference
+    hl.init(default_reference=reference)
 
-    if multi_fam:
-        # pull all samples from all requested families
-        multi_fam_mt = obtain_mt_subset(mt, list(all_samples))
-        # force-write this family MT to a test location
-        multi_fam_mt.write(
-            os.path.join(gcp_test_bucket, 'multiple_families.mt'),
-            overwrite=True
-        )
+    # check samples all present, before paying for any extraction
+    check_samples_present(all_samples, families_dict, get_mt_samples(gcp_mt_full))
 
-    # check samples all present
-    check_samples_in_mt(all_samples, families_dict, mt)
+    mt = read_mt(gcp_mt_full)
 
-    # for each family, dump both a small MT and a VCF containing the same samples/variants
-    for family, samples in families_dict.items():
+    if entry_fields:
+        fields = entry_fields.split(',')
+        # the genotype is always needed to find the variant rows
+        if variants_only and 'GT' not in fields:
+            fields.append('GT')
+        mt = slim_mt(mt, fields)
 
-        # pull out only this family's samples from the MT
-        family_mt = obtain_mt_subset(mt, samples)
+    if drop_annotations:
+        mt = drop_cohort_annotations(mt)
 
-        if not skip_mt:
-            # write this family MT to a test location
-            family_mt.write(os.path.join(gcp_test_bucket, f'{family}.mt'))
+    # the multi-family MT doubles as the checkpoint when it's requested
+    if multi_fam:
+        checkpoint_path = os.path.join(output_dir, 'multiple_families.mt')
+    else:
+        checkpoint_path = hl.utils.new_temp_file('multiple_families', 'mt')
+
+    # pull all samples from all requested families in one scan of the cohort MT
+    multi_fam_mt = checkpoint_subset(
+        mt, list(all_samples), checkpoint_path, variants_only=variants_only
+    )
 
-        if not skip_vcf:
+    # pull out each family's samples from the compact checkpoint
+    family_mts = {}
+    for family, samples in families_dict.items():
+        family_mt = obtain_mt_subset(multi_fam_mt, samples)
+        if variants_only:
+            family_mt = filter_to_variant_rows(family_mt)
+        family_mts[family] = family_mt
+
+    outputs = {family: {} for family in family_mts}  # type: ignore
+    if not skip_mt:
+        if len(family_mts) >= fan_out_min:
+            # write all family MTs to a test location in a single pass
+            for family, path in write_family_mts(family_mts, output_dir).items():
+                outputs[family]['mt'] = path
+        else:
+            for family, family_mt in family_mts.items():
+                # write this family MT to a test location
+                outputs[family]['mt'] = os.path.join(output_dir, f'{family}.mt')
+                family_mt.write(outputs[family]['mt'])
+
+    if not skip_vcf:
+        for family, family_mt in family_mts.items():
             # revert to a VCF file format, and write to a test location
             # hail generic method, so the MT is an argument
-            hl.export_vcf(family_mt, os.path.join(gcp_test_bucket, f'{family}.vcf.bgz'))
+            outputs[family]['vcf'] = os.path.join(output_dir, f'{family}.vcf.bgz')
+            hl.export_vcf(family_mt, outputs[family]['vcf'])
+
+    write_output_index(outputs, output_dir)
 
 
 if __name__ == '__main__':
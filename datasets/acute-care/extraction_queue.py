@@ -0,0 +1,390 @@
+#!/usr/bin/env python3
+
+
+"""
+Queue-and-coalesce submission of family extraction requests
+
+Each `submit` call adds a families JSON string (as printed by
+families_to_samples.py) to a queue in the dataset's test-tmp bucket. Pending
+requests are merged into a single families dict and extracted by one job,
+which fans the outputs back out per family. This happens once the oldest
+pending request is older than the coalescing window, or once the queue holds
+the maximum number of requests
+
+e.g.
+
+python3 extraction_queue.py submit --dataset acute-care --json-str '{"FAM1":["P1"]}'
+python3 extraction_queue.py flush --dataset acute-care
+
+`flush` is also run by every `submit`. If that leaves requests pending, `submit`
+also schedules a Batch job which runs `flush` once the window has elapsed, so
+the last request of a burst isn't left waiting for another submission;
+`flush --force` submits all pending requests
+
+Requests with different extraction options (e.g. --skip_vcf) are never merged
+
+Each job writes to its own run folder, see extract_trio_vcf.py. The batch
+manifest in extraction-queue/batches/ maps each request's families to the
+extracted families, and gives the families.json index of each job's outputs
+"""
+
+
+import json
+import logging
+import os
+import sys
+import uuid
+from collections import defaultdict
+from datetime import datetime, timezone
+from itertools import chain
+from shlex import quote
+from typing import List, Optional, Tuple
+
+import click
+import hailtop.batch as hb
+from google.api_core.exceptions import NotFound, PreconditionFailed
+from google.cloud import storage
+
+from extract_trio_vcf import extraction_output_dir
+from extraction_wrapper import (
+    add_extraction_job,
+    cohort_mt_path,
+    estimate_job_size,
+    load_families,
+    prepare_repo_job,
+)
+
+
+QUEUE_PREFIX = 'extraction-queue'
+PENDING = 'pending'
+CLAIMED = 'claimed'
+BATCHES = 'batches'
+EXTRACTION_SCRIPT = 'extract_trio_vcf.py'
+QUEUE_SCRIPT = 'extraction_queue.py'
+
+
+def queue_bucket(client: storage.Client, dataset: str) -> storage.Bucket:
+    """
+    the queue lives in the test-tmp bucket, alongside the extraction outputs
+    """
+    return client.bucket(f'cpg-{dataset}-test-tmp')
+
+
+def enqueue(
+    bucket: storage.Bucket, families: dict, options: List[str], now: datetime
+) -> str:
+    """
+    writes a single request to the pending queue
+    :return: str, the request ID
+    """
+    request_id = f'{now.strftime("%Y%m%dT%H%M%S")}-{uuid.uuid4().hex[:8]}'
+    request = {
+        'id': request_id,
+        'created': now.isoformat(),
+        'families': families,
+        'options': options,
+    }
+    bucket.blob(f'{QUEUE_PREFIX}/{PENDING}/{request_id}.json').upload_from_string(
+        json.dumps(request), content_type='application/json'
+    )
+    return request_id
+
+
+def list_pending(bucket: storage.Bucket) -> List[Tuple[storage.Blob, dict]]:
+    """
+    reads all pending requests, oldest first
+    """
+    blobs = sorted(
+        bucket.list_blobs(prefix=f'{QUEUE_PREFIX}/{PENDING}/'), key=lambda b: b.name
+    )
+    return [(blob, json.loads(blob.download_as_bytes())) for blob in blobs]
+
+
+def should_flush(
+    requests: List[dict], now: datetime, window_seconds: int, max_requests: int
+) -> bool:
+    """
+    pending requests are submitted once the oldest has waited out the window,
+    or once there are enough of them
+    """
+    if not requests:
+        return False
+    if len(requests) >= max_requests:
+        return True
+    oldest = min(datetime.fromisoformat(request['created']) for request in requests)
+    return (now - oldest).total_seconds() >= window_seconds
+
+
+def merge_requests(requests: List[dict]) -> Tuple[dict, dict]:
+    """
+    merges the families from all requests into a single families dict
+    a family requested again with the same samples as any family already merged
+    under its name is collapsed into it; a family name requested with new
+    samples is suffixed with the ID of the later request
+    :return: tuple of the merged families, and a per-request lookup of each
+        requested family name to the family name it is extracted under
+    """
+    merged = {}  # type: ignore
+    merged_names = defaultdict(list)  # requested name: names it is merged under
+    outputs_by_request = {}
+    for request in requests:
+        outputs = {}
+        for family, samples in request['families'].items():
+            output_family = next(
+                (
+                    name
+                    for name in merged_names[family]
+                    if sorted(merged[name]) == sorted(samples)
+                ),
+                None,
+            )
+            if output_family is None:
+                output_family = family
+                if merged_names[family]:
+                    output_family = f'{family}_{request["id"]}'
+                    logging.warning(
+                        'Family %s requested with different samples, extracting as %s',
+                        family,
+                        output_family,
+                    )
+                merged[output_family] = samples
+                merged_names[family].append(output_family)
+            outputs[family] = output_family
+        outputs_by_request[request['id']] = outputs
+    return merged, outputs_by_request
+
+
+def claim(
+    bucket: storage.Bucket, blob: storage.Blob, batch_id: str
+) -> Optional[storage.Blob]:
+    """
+    moves a pending request into this batch's claimed folder
+    the delete is conditional on the generation we read, so a request is only
+    ever claimed by a single flush
+    :return: the claimed blob, or None if another flush claimed it first
+    """
+    claimed_name = f'{QUEUE_PREFIX}/{CLAIMED}/{batch_id}/{os.path.basename(blob.name)}'
+    claimed_blob = bucket.copy_blob(blob, bucket, claimed_name)
+    try:
+        blob.delete(if_generation_match=blob.generation)
+    except (NotFound, PreconditionFailed):
+        claimed_blob.delete()
+        return None
+    return claimed_blob
+
+
+def requeue(bucket: storage.Bucket, claimed_blobs: List[storage.Blob]):
+    """
+    moves claimed requests back to the pending queue, for the next flush
+    """
+    for claimed_blob in claimed_blobs:
+        pending_name = f'{QUEUE_PREFIX}/{PENDING}/{os.path.basename(claimed_blob.name)}'
+        bucket.copy_blob(claimed_blob, bucket, pending_name)
+        claimed_blob.delete()
+
+
+def add_coalesced_job(
+    batch: hb.Batch,
+    dataset: str,
+    options: tuple,
+    requests: List[dict],
+    run_id: str,
+) -> dict:
+    """
+    adds one extraction job for the merged families of the requests
+    :return: dict, the manifest entry of the job
+    """
+    families, outputs_by_request = merge_requests(requests)
+    n_samples = len(set(chain.from_iterable(families.values())))
+    script = ' '.join(
+        [
+            EXTRACTION_SCRIPT,
+            '--json-str',
+            quote(json.dumps(families, separators=(',', ':'))),
+            '--dataset',
+            dataset,
+            '--run_id',
+            run_id,
+            *[quote(option) for option in options],
+        ]
+    )
+    add_extraction_job(
+        batch,
+        script,
+        estimate_job_size(cohort_mt_path(dataset), n_samples),
+        job_name=f'extract_from_cohort_mt_{run_id}',
+    )
+    logging.info(
+        'Coalesced %d requests into %d families', len(requests), len(families)
+    )
+    return {
+        'options': list(options),
+        'families': families,
+        'requests': outputs_by_request,
+        # maps each extracted family to the paths of its outputs
+        'output_index': os.path.join(
+            extraction_output_dir(dataset, run_id), 'families.json'
+        ),
+    }
+
+
+def flush(
+    dataset: str,
+    window_seconds: int,
+    max_requests: int,
+    force: bool = False,
+    now: Optional[datetime] = None,
+) -> bool:
+    """
+    claims all pending requests and submits one extraction job per set of options
+    if the batch can't be built or submitted, the claimed requests are requeued
+    :return: bool, whether any requests were left pending
+    """
+    now = now or datetime.now(timezone.utc)
+    bucket = queue_bucket(storage.Client(), dataset)
+
+    pending = list_pending(bucket)
+    if not force and not should_flush(
+        [request for _, request in pending], now, window_seconds, max_requests
+    ):
+        logging.info('%d requests pending, not yet submitting', len(pending))
+        return bool(pending)
+
+    batch_id = f'{now.strftime("%Y%m%dT%H%M%S")}-{uuid.uuid4().hex[:8]}'
+    claimed_blobs = []
+    requests_by_options = defaultdict(list)
+    for blob, request in pending:
+        claimed_blob = claim(bucket, blob, batch_id)
+        if claimed_blob:
+            claimed_blobs.append(claimed_blob)
+            requests_by_options[tuple(request['options'])].append(request)
+    if not requests_by_options:
+        logging.info('No requests left to claim')
+        return False
+
+    manifest = {'batch_id': batch_id, 'jobs': []}  # type: ignore
+    try:
+        batch = hb.Batch(
+            name='cohort_mt_extraction',
+            backend=hb.ServiceBackend(
+                billing_project=os.getenv('HAIL_BILLING_PROJECT'),
+                bucket=os.getenv('HAIL_BUCKET'),
+            ),
+        )
+        for index, (options, requests) in enumerate(requests_by_options.items()):
+            manifest['jobs'].append(
+                add_coalesced_job(
+                    batch, dataset, options, requests, f'{batch_id}-{index}'
+                )
+            )
+        batch.run(wait=False)
+    except Exception:
+        logging.error('Submission failed, requeueing %d requests', len(claimed_blobs))
+        requeue(bucket, claimed_blobs)
+        raise
+
+    # only written once the batch is submitted, so every manifest has a batch
+    bucket.blob(f'{QUEUE_PREFIX}/{BATCHES}/{batch_id}.json').upload_from_string(
+        json.dumps(manifest, indent=4), content_type='application/json'
+    )
+    return False
+
+
+def schedule_flush(dataset: str, window_seconds: int, max_requests: int):
+    """
+    submits a Batch job which waits out the window, then flushes the queue
+    every pending request gets one, so it's always submitted within about a
+    window of arriving, without another request to trigger the flush
+    """
+    batch = hb.Batch(
+        name='extraction_queue_flush',
+        backend=hb.ServiceBackend(
+            billing_project=os.getenv('HAIL_BILLING_PROJECT'),
+            bucket=os.getenv('HAIL_BUCKET'),
+        ),
+    )
+    job = batch.new_job(name=f'flush_{dataset}_extraction_queue')
+    subdir = prepare_repo_job(job)
+    job.command(
+        f'sleep {window_seconds} && cd ./{subdir} && '
+        f'python3 {QUEUE_SCRIPT} flush --dataset {quote(dataset)} '
+        f'--window {window_seconds} --max-requests {max_requests}'
+    )
+    batch.run(wait=False)
+
+
+@click.group()
+def cli():
+    """
+    queue family extraction requests, and submit them in coalesced batches
+    """
+
+
+@cli.command('submit', context_settings={'ignore_unknown_options': True})
+@click.option(
+    '--dataset', required=True, help='name of the dataset to use (gcp bucket names)'
+)
+@click.option(
+    '--json-str',
+    'json_str',
+    required=True,
+    help='this is the formatted json string of family_sample_lookups',
+)
+@click.option(
+    '--window',
+    'window_seconds',
+    default=900,
+    type=click.INT,
+    help='seconds to wait for further requests before submitting',
+)
+@click.option(
+    '--max-requests',
+    'max_requests',
+    default=50,
+    type=click.INT,
+    help='number of pending requests which triggers an immediate submission',
+)
+@click.argument('options', nargs=-1, type=click.UNPROCESSED)
+def submit_command(dataset, json_str, window_seconds, max_requests, options):
+    """
+    adds a request to the queue, with any further extract_trio_vcf.py OPTIONS
+    """
+    now = datetime.now(timezone.utc)
+    bucket = queue_bucket(storage.Client(), dataset)
+    request_id = enqueue(bucket, load_families(json_str), list(options), now)
+    logging.info('Queued request %s', request_id)
+    if flush(dataset, window_seconds, max_requests, now=now):
+        schedule_flush(dataset, window_seconds, max_requests)
+
+
+@cli.command('flush')
+@click.option(
+    '--dataset', required=True, help='name of the dataset to use (gcp bucket names)'
+)
+@click.option(
+    '--window',
+    'window_seconds',
+    default=900,
+    type=click.INT,
+    help='seconds to wait for further requests before submitting',
+)
+@click.option(
+    '--max-requests',
+    'max_requests',
+    default=50,
+    type=click.INT,
+    help='number of pending requests which triggers an immediate submission',
+)
+@click.option(
+    '--force', is_flag=True, default=False, help='submit all pending requests now'
+)
+def flush_command(dataset, window_seconds, max_requests, force):
+    """
+    submits pending requests if the window has elapsed or the queue is full
+    """
+    flush(dataset, window_seconds, max_requests, force=force)
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, stream=sys.stderr)
+    cli()
@@ -2,8 +2,14 @@
 
 
 """
-Wrapper script to initiate a hail batch, and submit using an
-analysis-runner managed dataproc cluster
+Wrapper script to initiate a hail batch, and submit the extraction script
+
+The size of the job is estimated from the cohort MT metadata and the number
+of requested samples: the whole cohort is scanned, and the entries of the
+requested samples are written. Small jobs run on a single-node local Hail
+backend in a plain Batch job; large jobs are submitted using an
+analysis-runner managed dataproc cluster, with the worker count derived from
+the MT partition count
 
 A consequence of this wrapping is that the json-str argument needs shlex
 escaping to be passed successfully as a CLI argument to the pyspark process
@@ -16,20 +22,208 @@ becomes
 """
 
 
+import gzip
+import json
+import logging
+import math
 import os
+import shlex
+import subprocess
 import sys
+from itertools import chain
+from typing import List, Tuple
+
 import hailtop.batch as hb
+from google.cloud import storage
 
 from analysis_runner import dataproc
+from analysis_runner.git import (
+    get_git_commit_ref_of_current_repository,
+    get_repo_name_from_current_directory,
+    prepare_git_job,
+)
+
+
+# jobs with up to this much work, in scanned cohort entries, run on a local backend
+LOCAL_MAX_WORK = 5_000_000_000
+# writing an entry of the output (MT write and VCF export) costs about as much
+# as scanning this many entries of the cohort MT
+OUTPUT_ENTRY_WEIGHT = 20
+LOCAL_CPU = 16
+LOCAL_SPARK_MEMORY = '80g'
+
+# dataproc secondary workers are sized to process this many partitions each
+PARTITIONS_PER_WORKER = 32
+MIN_SECONDARY_WORKERS = 2
+MAX_SECONDARY_WORKERS = 100
+
+
+def get_option_value(args: List[str], option: str) -> str:
+    """
+    finds the value following a CLI option in a list of arguments
+    """
+    try:
+        return args[args.index(option) + 1]
+    except (ValueError, IndexError):
+        return ''
+
+
+def load_families(json_str: str) -> dict:
+    """
+    parses a families JSON string, which may still carry the shlex quoting
+    intended for dataproc
+    """
+    try:
+        return json.loads(json_str)
+    except json.JSONDecodeError:
+        return json.loads(shlex.split(json_str)[0])
+
+
+def parse_script_args(args: List[str]) -> Tuple[str, dict]:
+    """
+    pulls the dataset name and families dict from the extraction script arguments
+    """
+    dataset = get_option_value(args, '--dataset')
+    families = load_families(get_option_value(args, '--json-str'))
+    return dataset, families
+
+
+def cohort_mt_path(dataset: str) -> str:
+    """
+    location of the cohort MT, matching the extraction script
+    """
+    return f'gs://cpg-{dataset}-main/mt/{dataset}.mt'
+
+
+def read_hail_metadata(client: storage.Client, path: str) -> dict:
+    """
+    reads a gzipped hail metadata file from GCS
+    """
+    bucket_name, blob_name = path[len('gs://') :].split('/', maxsplit=1)
+    blob = client.bucket(bucket_name).blob(blob_name)
+    return json.loads(gzip.decompress(blob.download_as_bytes()))
+
+
+def estimate_job_size(mt_path: str, n_samples: int) -> dict:
+    """
+    estimates the size of an extraction from the MT metadata, without reading
+    any of the data itself
+    :param mt_path: str, location of the cohort MT
+    :param n_samples: int, number of samples requested for extraction
+    :return: dict, summary of the MT dimensions and estimated work
+    """
+    client = storage.Client()
+    row_counts = read_hail_metadata(client, f'{mt_path}/metadata.json.gz')[
+        'components'
+    ]['partition_counts']['counts']
+    col_counts = read_hail_metadata(client, f'{mt_path}/cols/metadata.json.gz')[
+        'components'
+    ]['partition_counts']['counts']
+
+    n_rows = sum(row_counts)
+    n_cols = sum(col_counts)
+    return {
+        'rows': n_rows,
+        'cols': n_cols,
+        'partitions': len(row_counts),
+        'scanned_entries': n_rows * n_cols,
+        'output_entries': n_rows * n_samples,
+    }
+
+
+def estimated_work(size: dict) -> int:
+    """
+    work of an extraction in scanned-entry equivalents: the full cohort scan,
+    plus writing the requested samples' entries
+    """
+    return size['scanned_entries'] + OUTPUT_ENTRY_WEIGHT * size['output_entries']
+
+
+def runs_locally(size: dict) -> bool:
+    """
+    whether an extraction of this size runs on a local backend, not dataproc
+    """
+    return estimated_work(size) <= LOCAL_MAX_WORK
+
+
+def secondary_workers_for(partitions: int) -> int:
+    """
+    number of dataproc secondary workers for an MT with this many partitions
+    """
+    workers = math.ceil(partitions / PARTITIONS_PER_WORKER)
+    return max(MIN_SECONDARY_WORKERS, min(MAX_SECONDARY_WORKERS, workers))
+
+
+def prepare_repo_job(job: hb.job.Job) -> str:
+    """
+    authenticates the job, and checks out the same commit of this repository
+    :return: str, the path of this directory within the checkout
+    """
+    job.image(os.getenv('DRIVER_IMAGE'))
+    job.command('gcloud -q auth activate-service-account --key-file=/gsa-key/key.json')
+    prepare_git_job(
+        job=job,
+        repo_name=get_repo_name_from_current_directory(),
+        commit=get_git_commit_ref_of_current_repository(),
+    )
+    return (
+        subprocess.check_output(['git', 'rev-parse', '--show-prefix']).decode().strip()
+    )
+
+
+def add_local_job(batch: hb.Batch, script: str, job_name: str) -> hb.job.Job:
+    """
+    adds a plain Batch job, running the script on a single-node local Hail backend
+    """
+    job = batch.new_job(name=job_name)
+    job.cpu(LOCAL_CPU).memory('highmem')
+    subdir = prepare_repo_job(job)
+    job.command(
+        f'cd ./{subdir} && '
+        f'PYSPARK_SUBMIT_ARGS="--driver-memory {LOCAL_SPARK_MEMORY} pyspark-shell" '
+        f'python3 {script}'
+    )
+    return job
+
+
+def add_extraction_job(
+    batch: hb.Batch, script: str, size: dict, job_name: str = 'extract_from_cohort_mt'
+) -> hb.job.Job:
+    """
+    adds the extraction job to the batch, choosing the backend from the job size
+    """
+    if runs_locally(size):
+        logging.info('Running extraction on a local backend: %s', size)
+        return add_local_job(batch, script, job_name)
+
+    num_secondary_workers = secondary_workers_for(size['partitions'])
+    logging.info(
+        'Running extraction on dataproc with %d secondary workers: %s',
+        num_secondary_workers,
+        size,
+    )
+    return dataproc.hail_dataproc_job(
+        batch=batch,
+        script=script,
+        max_age='4h',
+        job_name=job_name,
+        num_secondary_workers=num_secondary_workers,
+        cluster_name='cohort_mt_extraction with max-age=4h',
+    )
 
 
 def main():
     """
     Create a Hail Batch
-    analysis-runner helper creates a DataProc cluster, add the job
+    Estimate the size of the extraction, and add either a local or dataproc job
     Set off the batch
     """
 
+    script_args = sys.argv[1:]
+    dataset, families = parse_script_args(script_args)
+    n_samples = len(set(chain.from_iterable(families.values())))
+    size = estimate_job_size(cohort_mt_path(dataset), n_samples)
+
     service_backend = hb.ServiceBackend(
         billing_project=os.getenv('HAIL_BILLING_PROJECT'),
         bucket=os.getenv('HAIL_BUCKET'),
@@ -41,17 +235,11 @@ def main():
         backend=service_backend
     )
 
-    _my_job = dataproc.hail_dataproc_job(
-        batch=batch,
-        script=' '.join(sys.argv[1:]),
-        max_age='4h',
-        job_name='extract_from_cohort_mt',
-        num_secondary_workers=4,
-        cluster_name='cohort_mt_extraction with max-age=4h',
-    )  # noqa: F841
+    _my_job = add_extraction_job(batch, ' '.join(script_args), size)  # noqa: F841
 
     batch.run(wait=False)
 
 
 if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, stream=sys.stderr)
     main()
@@ -0,0 +1,182 @@
+import json
+import os
+import stat
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import pytest
+
+# import the local methods
+from families_to_samples import (
+    find_complete_trio_families,
+    get_family_to_sample_map,
+    index_pedigree,
+)
+from metadata_client import MetadataClient, token_expiry
+
+
+"""
+tests for the family lookups, and for the sample-metadata client, run against
+a local mock of the API
+the mock serves the three endpoints used by families_to_samples.py,
+and counts the requests it receives so caching can be checked
+"""
+
+
+PEDIGREE = (
+    "#Family ID\tIndividual ID\tPaternal ID\tMaternal ID\tSex\tAffected\n"
+    "FAM1\tFAM1_proband\tFAM1_father\tFAM1_mother\t1\t2\n"
+    "FAM1\tFAM1_father\t\t\t1\t1\n"
+    "FAM1\tFAM1_mother\t\t\t2\t1\n"
+    "FAM2\tFAM2_proband\t\tFAM2_mother\t2\t2\n"
+    "FAM2\tFAM2_mother\t\t\t2\t1\n"
+)
+PID_TO_SAMPLE = [
+    ["FAM1_proband", "CPG1"],
+    ["FAM1_father", "CPG2"],
+    ["FAM1_mother", "CPG3"],
+    ["FAM2_proband", "CPG4"],
+    ["FAM2_mother", "CPG5"],
+]
+INTERNAL_TO_EXTERNAL = {f"CPG{index}": f"EXT{index}" for index in range(1, 6)}
+
+RESPONSES = {
+    "/family/project/pedigree": PEDIGREE.encode(),
+    "/participant/project/external-pid-to-internal-sample-id": json.dumps(
+        PID_TO_SAMPLE
+    ).encode(),
+    "/sample/project/id-map/internal/all": json.dumps(INTERNAL_TO_EXTERNAL).encode(),
+}
+QUERIES = {
+    "pedigree": dict(endpoint="family/project/pedigree", accept="*/*"),
+    "pid_to_sample": dict(
+        endpoint="participant/project/external-pid-to-internal-sample-id",
+        accept="application/json",
+    ),
+    "internal_to_external": dict(
+        endpoint="sample/project/id-map/internal/all", accept="application/json"
+    ),
+}
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    """
+    serves fixed responses, with an ETag for conditional revalidation
+    """
+
+    requests_seen = []  # type: ignore
+
+    def do_GET(self):
+        path = self.path.split("?")[0]
+        self.requests_seen.append((path, self.headers.get("If-None-Match")))
+        if path not in RESPONSES:
+            self.send_response(404)
+            self.end_headers()
+            return
+        etag = f'"{hash(RESPONSES[path])}"'
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("ETag", etag)
+        self.send_header("Content-Length", str(len(RESPONSES[path])))
+        self.end_headers()
+        self.wfile.write(RESPONSES[path])
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture(scope="module")
+def mock_api():
+    server = HTTPServer(("127.0.0.1", 0), MockHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_port}"
+    server.shutdown()
+
+
+@pytest.fixture()
+def requests_seen():
+    MockHandler.requests_seen.clear()
+    yield MockHandler.requests_seen
+
+
+def test_index_pedigree():
+    family_index = index_pedigree(PEDIGREE.splitlines(keepends=True))
+    assert family_index == {
+        "FAM1": ["FAM1_proband", "FAM1_father", "FAM1_mother"],
+        "FAM2": ["FAM2_proband", "FAM2_mother"],
+    }
+
+
+@pytest.mark.parametrize(
+    "external,expected",
+    [(False, ["CPG4", "CPG5"]), (True, ["EXT4", "EXT5"])],
+)
+def test_family_to_sample_map(external, expected):
+    result = get_family_to_sample_map(
+        family_index=index_pedigree(PEDIGREE.splitlines()),
+        families=("FAM2", "FAM3"),
+        external=external,
+        pid_to_id=dict(PID_TO_SAMPLE),
+        int_to_ext=INTERNAL_TO_EXTERNAL,
+    )
+    assert result == {"FAM2": expected, "FAM3": []}
+
+
+def test_complete_trio_families():
+    assert find_complete_trio_families(PEDIGREE, dict(PID_TO_SAMPLE)) == ["FAM1"]
+    # a parent without a sample doesn't count as present
+    assert find_complete_trio_families(PEDIGREE, dict(PID_TO_SAMPLE[1:])) == []
+
+
+def test_token_expiry():
+    # header.payload.signature, payload is {"exp": 1700000000}
+    token = "e30.eyJleHAiOiAxNzAwMDAwMDAwfQ.sig"
+    assert token_expiry(token) == 1700000000
+    assert token_expiry("not-a-jwt") == 0
+
+
+def test_get_many(mock_api, requests_seen, tmp_path):
+    client = MetadataClient("token", url_base=mock_api, cache_dir=str(tmp_path))
+    responses = client.get_many(QUERIES)
+    assert responses["pedigree"].decode() == PEDIGREE
+    assert json.loads(responses["pid_to_sample"]) == PID_TO_SAMPLE
+    assert json.loads(responses["internal_to_external"]) == INTERNAL_TO_EXTERNAL
+    assert len(requests_seen) == 3
+
+
+def test_cached_within_ttl(mock_api, requests_seen, tmp_path):
+    client = MetadataClient("token", url_base=mock_api, cache_dir=str(tmp_path))
+    client.get_many(QUERIES)
+    responses = client.get_many(QUERIES)
+    assert json.loads(responses["pid_to_sample"]) == PID_TO_SAMPLE
+    assert len(requests_seen) == 3
+
+
+def test_cache_private(mock_api, tmp_path):
+    client = MetadataClient("token", url_base=mock_api, cache_dir=str(tmp_path))
+    client.get_many(QUERIES)
+    response_dir = tmp_path / "responses"
+    assert stat.S_IMODE(os.stat(response_dir).st_mode) == 0o700
+    for path in response_dir.iterdir():
+        assert stat.S_IMODE(os.stat(path).st_mode) == 0o600
+
+
+def test_revalidated_after_ttl(mock_api, requests_seen, tmp_path):
+    client = MetadataClient("token", url_base=mock_api, cache_dir=str(tmp_path), ttl=0)
+    client.get(**QUERIES["pedigree"])
+    content = client.get(**QUERIES["pedigree"])
+    assert content.decode() == PEDIGREE
+    # the second request is conditional, and answered with a 304
+    assert len(requests_seen) == 2
+    assert requests_seen[1][1] is not None
+
+
+def test_no_cache(mock_api, requests_seen):
+    client = MetadataClient("token", url_base=mock_api, cache_dir=None)
+    client.get(**QUERIES["pedigree"])
+    client.get(**QUERIES["pedigree"])
+    assert len(requests_seen) == 2
@@ -11,59 +11,79 @@ output is intended for MatrixTable sub-setting script within this directory
 
 
 import json
-import subprocess
-from csv import DictReader
+from collections import defaultdict
 from io import StringIO
 from shlex import quote
-from typing import Tuple
+from typing import Dict, Iterable, List, Tuple
 
 import click
-import pandas as pd
-import requests
 
+from metadata_client import (
+    DEFAULT_CACHE_DIR,
+    DEFAULT_TTL,
+    URL_BASE,
+    MetadataClient,
+    get_auth,
+)
 
-def get_auth() -> str:
-    """
-    uses a shell to execute the auth token grab
-    :return: str: the token generated by the gcloud process
 
-    This will only work as a locally executed script
+def index_pedigree(pedigree_lines: Iterable[str]) -> Dict[str, List[str]]:
     """
-    return (
-        subprocess.check_output(['gcloud', 'auth', 'print-identity-token'])
-        .decode()
-        .strip()
-    )
+    stream-parses the pedigree TSV straight into a family-indexed lookup
+    :param pedigree_lines: lines of the pedigree TSV, with a '#'-prefixed header
+    :return: dict, family ID: [individual IDs, in pedigree order]
+    """
+    lines = iter(pedigree_lines)
+    header = next(lines).lstrip('#').rstrip('\n').split('\t')
+    family_col = header.index('Family ID')
+    individual_col = header.index('Individual ID')
+
+    family_index = defaultdict(list)  # type: ignore
+    for line in lines:
+        fields = line.rstrip('\n').split('\t')
+        if len(fields) <= max(family_col, individual_col):
+            continue
+        family_index[fields[family_col]].append(fields[individual_col])
+    return dict(family_index)
 
 
-def get_response(url, headers, query_params=None) -> requests.Response:
+def find_complete_trio_families(pedigree_tsv: str, pid_to_id: dict) -> List[str]:
     """
-    perform the actual execution of the URL with provided parameters
-    :param url: str
-    :param headers: dict
-    :param query_params: [optional] dict
-    :return: requests.Response
+    vectorised search for all families containing an affected individual with
+    both parents present, where all three have a sample
+    :param pedigree_tsv: str, the full pedigree TSV with a '#'-prefixed header
+    :param pid_to_id: dict, lookup of int. participant ID to int. sample ID
+    :return: sorted list of family IDs
     """
+    # pandas is slow to import, and only needed for this search
+    import pandas as pd
 
-    resp = requests.get(headers=headers, url=url, params=query_params)
-
-    # raise exception if `not resp.ok`
-    resp.raise_for_status()
-
-    return resp
+    pedigree_df = pd.read_csv(
+        StringIO(pedigree_tsv.lstrip('#')), sep='\t', dtype=str, keep_default_na=False
+    )
+    with_sample = pedigree_df['Individual ID'][
+        pedigree_df['Individual ID'].isin(pid_to_id.keys())
+    ]
+    trios = pedigree_df.loc[
+        (pedigree_df['Affected'] == '2')
+        & pedigree_df['Individual ID'].isin(with_sample)
+        & pedigree_df['Paternal ID'].isin(with_sample)
+        & pedigree_df['Maternal ID'].isin(with_sample)
+    ]
+    return sorted(trios['Family ID'].unique())
 
 
 def get_family_to_sample_map(
-    df: pd.DataFrame,
-    families: Tuple[str],
+    family_index: Dict[str, List[str]],
+    families: Iterable[str],
     external: bool,
     pid_to_id: dict,
     int_to_ext: dict,
 ) -> dict:
     """
     take families from cli input; for each find all sample IDs. Return as a JSON dict
-    :param df: the pedigrees dataframe
-    :param families: Tuple[str], containing family ID strings
+    :param family_index: dict, family ID: [individual IDs], from index_pedigree
+    :param families: Iterable[str], containing family ID strings
     :param external: bool, True to return external sample IDs, false for CPG IDs
     :param pid_to_id: dict, lookup of int. participant ID to int. sample ID
     :param int_to_ext: dict, lookup of int. sample ID to external
@@ -77,9 +97,8 @@ def get_family_to_sample_map(
 
         dict_result[family_id] = []
 
-        # isolate all rows containing the family members from the pedigree table
-        members_df = df.loc[df['Family ID'] == family_id]
-        original_ids = {row['Individual ID'] for index, row in members_df.iterrows()}
+        # all family members, from the family-indexed pedigree
+        original_ids = dict.fromkeys(family_index.get(family_id, []))
 
         # translate those IDs to something usable
         for member_id in original_ids:
@@ -126,78 +145,118 @@ def get_family_to_sample_map(
     default='NOT_PROVIDED',
     help='A JWT for user authentication',
 )
-def main(project: str, families: Tuple[str], external: bool, auth_token: str):
+@click.option(
+    '--url-base',
+    'url_base',
+    type=click.STRING,
+    default=URL_BASE,
+    help='base URL of the sample-metadata API, e.g. a local mock',
+)
+@click.option(
+    '--cache-dir',
+    'cache_dir',
+    type=click.STRING,
+    default=DEFAULT_CACHE_DIR,
+    help='directory for the cached auth token and API responses',
+)
+@click.option(
+    '--ttl',
+    'ttl',
+    type=click.INT,
+    default=DEFAULT_TTL,
+    help='seconds to reuse cached API responses before revalidating them',
+)
+@click.option(
+    '--no-cache',
+    'no_cache',
+    is_flag=True,
+    default=False,
+    help='if this is set, always fetch fresh API responses',
+)
+@click.option(
+    '--complete-trios',
+    'complete_trios',
+    type=click.BOOL,
+    default=False,
+    is_flag=True,
+    help='if this is set, also return all families with an affected proband '
+    'and both parents sequenced',
+)
+def main(
+    project: str,
+    families: Tuple[str],
+    external: bool,
+    auth_token: str,
+    url_base: str,
+    cache_dir: str,
+    ttl: int,
+    no_cache: bool,
+    complete_trios: bool,
+):
     """
     main process, using click args
     """
 
     if auth_token == 'NOT_PROVIDED':
-        auth_token = get_auth()
+        auth_token = get_auth(cache_dir)
 
-    # currently the 2 types of endpoint require different headers, with the same auth token
-    bearer_token = f'Bearer {auth_token}'
-    table_header = {'Accept': ACCEPT_ALL, 'Authorization': bearer_token}
-    mapping_header = {'Accept': ACCEPT_JSON, 'Authorization': bearer_token}
-
-    # core query params from documentation
-    # get the pedigrees across the entire project
-    response = get_response(
-        url=f'{URL_BASE}/{FAMILY_ENDPOINT}/{project}/{PEDIGREE}',
-        headers=table_header,
-        query_params={
-            'replace_with_participant_external_ids': True,
-            'replace_with_family_external_ids': True,  # False
-            'empty_participant_value': '',
-            'include_header': True,
-        },
+    client = MetadataClient(
+        auth_token=auth_token,
+        url_base=url_base,
+        cache_dir=None if no_cache else cache_dir,
+        ttl=ttl,
     )
 
-    # parse this into a series of dictionaries, then into a dataframe
-    dict_read = DictReader(
-        StringIO(response.content.decode().strip('#')), delimiter='\t'
+    # the three endpoints are independent, so are fetched concurrently
+    # currently the 2 types of endpoint require different headers, with the same auth token
+    responses = client.get_many(
+        {
+            # core query params from documentation
+            # get the pedigrees across the entire project
+            'pedigree': dict(
+                endpoint=f'{FAMILY_ENDPOINT}/{project}/{PEDIGREE}',
+                accept=ACCEPT_ALL,
+                query_params={
+                    'replace_with_participant_external_ids': True,
+                    'replace_with_family_external_ids': True,  # False
+                    'empty_participant_value': '',
+                    'include_header': True,
+                },
+            ),
+            # participant/acute-care/external-pid-to-internal-sample-id # JSON
+            'pid_to_sample': dict(
+                endpoint=f'{PARTICIPANT_ENDPOINT}/{project}/external-pid-to-internal-sample-id',
+                accept=ACCEPT_JSON,
+            ),
+            # sample/acute-care/id-map/internal/all # JSON
+            'internal_to_external': dict(
+                endpoint=f'{SAMPLE_ENDPOINT}/{project}/id-map/internal/all',
+                accept=ACCEPT_JSON,
+            ),
+        }
     )
-    pedigree_df = pd.DataFrame(list(dict_read))
-
-    # -#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#- #
-    # so now we have a dataframe of the entire pedigree structure
-    # NOTE - this is just a hack around, with examples of further hackery
-
-    # # example queries on pedigree_df - all affected females
-    # aff_females = pedigree_df.loc[(pedigree_df['Affected'] == '2') & (pedigree_df['Sex'] == '2')]
-    #
-    # # all members of those families
-    # aff_female_fams = df.loc[df['Family ID'].isin(aff_females['Family ID'].values)]
-    #
-    # # are there any affected parents? - affected and not 'proband'
-    # aff_parents = pedigree_df.loc[
-    #   (pedigree_df['Affected'] == '2') &
-    #   (~pedigree_df['Individual ID'].str.contains('proband')),
-    #   ['Family ID', 'Individual ID']
-    # ]
-    # -#-#-#-#-#-#-#-#-#-#-#-#-#-#-#-#- #
+
+    # index the pedigree by family as it is parsed
+    pedigree_tsv = responses['pedigree'].decode()
+    family_index = index_pedigree(StringIO(pedigree_tsv))
 
     # we can obtain a lookup on the internal sample ID using the external PID
-    # participant/acute-care/external-pid-to-internal-sample-id # JSON
     # this will get us a CPG ID (INTernal, not INTeger)
-    response = get_response(
-        url=f'{URL_BASE}/{PARTICIPANT_ENDPOINT}/{project}/external-pid-to-internal-sample-id',
-        headers=mapping_header,
-    )
-    paired_samples_list = response.json()
+    paired_samples_list = json.loads(responses['pid_to_sample'])
     pid_to_sample_id = dict(
         zip([_[0] for _ in paired_samples_list], [_[1] for _ in paired_samples_list])
     )
 
     # we can then map the internal sample IDs to external sample IDs
-    # sample/acute-care/id-map/internal/all # JSON
-    response = get_response(
-        url=f'{URL_BASE}/{SAMPLE_ENDPOINT}/{project}/id-map/internal/all',
-        headers=mapping_header,
-    )
-    internal_to_ext_map = response.json()
+    internal_to_ext_map = json.loads(responses['internal_to_external'])
+
+    if complete_trios:
+        # add every family matching the predicate, after any requested explicitly
+        trio_families = find_complete_trio_families(pedigree_tsv, pid_to_sample_id)
+        families = tuple(dict.fromkeys(families + tuple(trio_families)))
 
     family_to_samples_dict = get_family_to_sample_map(
-        df=pedigree_df,
+        family_index=family_index,
         families=families,
         external=external,
         pid_to_id=pid_to_sample_id,
@@ -214,7 +273,6 @@ def main(project: str, families: Tuple[str], external: bool, auth_token: str):
     print(json_formatted)
 
 
-URL_BASE = 'https://sample-metadata-api-mnrpw3mdza-ts.a.run.app/api/v1'
 ACCEPT_ALL = '*/*'
 ACCEPT_JSON = 'application/json'
 FAMILY_ENDPOINT = 'family'
@@ -0,0 +1,193 @@
+"""
+client for the sample-metadata API, used by families_to_samples.py
+
+- connections are pooled in a single requests Session
+- independent endpoints can be fetched concurrently
+- the gcloud identity token is cached on disk until it expires
+- responses are cached on disk; within the TTL they are returned without a
+  request, after it they are revalidated using ETag/Last-Modified headers
+"""
+
+
+import base64
+import hashlib
+import json
+import os
+import subprocess
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Optional, Tuple
+
+
+URL_BASE = 'https://sample-metadata-api-mnrpw3mdza-ts.a.run.app/api/v1'
+DEFAULT_CACHE_DIR = os.path.join(
+    os.getenv('XDG_CACHE_HOME', os.path.expanduser('~/.cache')), 'fewgenomes'
+)
+DEFAULT_TTL = 600
+# refresh the token this many seconds before it actually expires
+TOKEN_EXPIRY_MARGIN = 60
+
+
+def token_expiry(token: str) -> float:
+    """
+    reads the expiry time from the payload of a JWT, without verifying it
+    :return: float, expiry as a unix timestamp, or 0 if it can't be read
+    """
+    try:
+        payload = token.split('.')[1]
+        payload += '=' * (-len(payload) % 4)
+        return float(json.loads(base64.urlsafe_b64decode(payload))['exp'])
+    except (IndexError, KeyError, TypeError, ValueError):
+        return 0
+
+
+def get_auth(cache_dir: str = DEFAULT_CACHE_DIR) -> str:
+    """
+    returns a gcloud identity token, reusing the cached token until it expires
+    :return: str: the token generated by the gcloud process
+
+    This will only work as a locally executed script
+    """
+    token_path = os.path.join(cache_dir, 'identity-token')
+    if os.path.exists(token_path):
+        with open(token_path) as handle:
+            token = handle.read().strip()
+        if token_expiry(token) - TOKEN_EXPIRY_MARGIN > time.time():
+            return token
+
+    token = (
+        subprocess.check_output(['gcloud', 'auth', 'print-identity-token'])
+        .decode()
+        .strip()
+    )
+    os.makedirs(cache_dir, mode=0o700, exist_ok=True)
+    atomic_write(token_path, token.encode(), mode=0o600)
+    return token
+
+
+def atomic_write(path: str, content: bytes, mode: int = 0o644):
+    """
+    replaces the file atomically, so concurrent readers never see a partial write
+    """
+    tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+    flags = os.O_WRONLY | os.O_CREAT | os.O_TRUNC
+    with open(os.open(tmp_path, flags, mode), 'wb') as handle:
+        handle.write(content)
+    os.replace(tmp_path, path)
+
+
+class MetadataClient:
+    """
+    pooled, concurrent and cached access to the sample-metadata API
+    """
+
+    def __init__(
+        self,
+        auth_token: str,
+        url_base: str = URL_BASE,
+        cache_dir: Optional[str] = DEFAULT_CACHE_DIR,
+        ttl: int = DEFAULT_TTL,
+        max_workers: int = 4,
+    ):
+        """
+        :param auth_token: str, JWT for user authentication
+        :param url_base: str, API location, e.g. a local mock for testing
+        :param cache_dir: str, response cache location; None disables the cache
+        :param ttl: int, seconds a cached response is used without revalidation
+        :param max_workers: int, number of concurrent requests
+        """
+        self.url_base = url_base.rstrip('/')
+        self.response_dir = os.path.join(cache_dir, 'responses') if cache_dir else None
+        self.ttl = ttl
+        self.max_workers = max_workers
+
+        # requests is imported here, so CLIs using the client start up quickly
+        import requests
+        from requests.adapters import HTTPAdapter
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=max_workers, pool_maxsize=max_workers)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.session.headers['Authorization'] = f'Bearer {auth_token}'
+
+    def _cache_paths(
+        self, url: str, accept: str, params: Optional[dict]
+    ) -> Tuple[str, str]:
+        """
+        paths of the cached metadata and body for a single request
+        """
+        key = hashlib.sha256(
+            json.dumps([url, accept, params], sort_keys=True).encode()
+        ).hexdigest()
+        base = os.path.join(self.response_dir, key)
+        return f'{base}.json', f'{base}.body'
+
+    def get(
+        self, endpoint: str, accept: str, query_params: Optional[dict] = None
+    ) -> bytes:
+        """
+        perform the actual execution of the URL with provided parameters,
+        via the response cache
+        :param endpoint: str, path relative to the API base
+        :param accept: str, value of the Accept header
+        :param query_params: [optional] dict
+        :return: bytes, the response content
+        """
+        url = f'{self.url_base}/{endpoint}'
+        headers = {'Accept': accept}
+
+        if not self.response_dir:
+            resp = self.session.get(url=url, headers=headers, params=query_params)
+            resp.raise_for_status()
+            return resp.content
+
+        meta_path, body_path = self._cache_paths(url, accept, query_params)
+        meta = None
+        if os.path.exists(meta_path) and os.path.exists(body_path):
+            with open(meta_path) as handle:
+                meta = json.load(handle)
+            if time.time() - meta['fetched'] < self.ttl:
+                with open(body_path, 'rb') as handle:
+                    return handle.read()
+            if meta.get('etag'):
+                headers['If-None-Match'] = meta['etag']
+            if meta.get('last_modified'):
+                headers['If-Modified-Since'] = meta['last_modified']
+
+        resp = self.session.get(url=url, headers=headers, params=query_params)
+
+        if resp.status_code == 304 and meta is not None:
+            meta['fetched'] = time.time()
+            atomic_write(meta_path, json.dumps(meta).encode(), mode=0o600)
+            with open(body_path, 'rb') as handle:
+                return handle.read()
+
+        # raise exception if `not resp.ok`
+        resp.raise_for_status()
+
+        meta = {
+            'url': url,
+            'fetched': time.time(),
+            'etag': resp.headers.get('ETag'),
+            'last_modified': resp.headers.get('Last-Modified'),
+        }
+        # responses hold participant metadata, so are only readable by the user
+        os.makedirs(self.response_dir, mode=0o700, exist_ok=True)
+        atomic_write(body_path, resp.content, mode=0o600)
+        atomic_write(meta_path, json.dumps(meta).encode(), mode=0o600)
+        return resp.content
+
+    def get_many(self, queries: Dict[str, dict]) -> Dict[str, bytes]:
+        """
+        fetches independent endpoints concurrently
+        :param queries: dict, name: keyword arguments for `get`
+        :return: dict, name: response content
+        """
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = {
+                name: executor.submit(self.get, **kwargs)
+                for name, kwargs in queries.items()
+            }
+            return {name: future.result() for name, future in futures.items()}
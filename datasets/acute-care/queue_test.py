@@ -0,0 +1,196 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from click.testing import CliRunner
+
+# import the local methods
+import extraction_queue
+from extraction_queue import (
+    BATCHES,
+    PENDING,
+    QUEUE_PREFIX,
+    enqueue,
+    flush,
+    merge_requests,
+    should_flush,
+    submit_command,
+)
+
+
+"""
+tests for the coalescing of extraction requests, and for the queue against an
+in-memory stand-in for the GCS bucket
+"""
+
+
+NOW = datetime(2021, 6, 1, 12, 0, tzinfo=timezone.utc)
+
+
+class FakeBlob:
+    """
+    the parts of storage.Blob used by the queue
+    """
+
+    def __init__(self, bucket, name):
+        self.bucket = bucket
+        self.name = name
+        self.generation = 1
+
+    def upload_from_string(self, data, content_type=None):
+        self.bucket.objects[self.name] = data
+
+    def download_as_bytes(self):
+        return self.bucket.objects[self.name].encode()
+
+    def delete(self, if_generation_match=None):
+        del self.bucket.objects[self.name]
+
+
+class FakeBucket:
+    """
+    the parts of storage.Bucket used by the queue
+    """
+
+    def __init__(self):
+        self.objects = {}
+
+    def blob(self, name):
+        return FakeBlob(self, name)
+
+    def list_blobs(self, prefix):
+        return [
+            FakeBlob(self, name) for name in self.objects if name.startswith(prefix)
+        ]
+
+    def copy_blob(self, blob, bucket, new_name):
+        bucket.objects[new_name] = self.objects[blob.name]
+        return FakeBlob(bucket, new_name)
+
+
+def request(request_id: str, families: dict, minutes_ago: int = 0) -> dict:
+    return {
+        "id": request_id,
+        "created": (NOW - timedelta(minutes=minutes_ago)).isoformat(),
+        "families": families,
+        "options": [],
+    }
+
+
+def test_should_flush():
+    assert not should_flush([], NOW, 900, 50)
+    assert not should_flush([request("r1", {}, minutes_ago=5)], NOW, 900, 50)
+    # the oldest request has waited out the window
+    assert should_flush(
+        [request("r1", {}, minutes_ago=5), request("r2", {}, minutes_ago=15)],
+        NOW,
+        900,
+        50,
+    )
+    # the queue is full
+    assert should_flush([request("r1", {}), request("r2", {})], NOW, 900, 2)
+
+
+def test_merge_requests_collapses_duplicates():
+    merged, outputs = merge_requests(
+        [
+            request("r1", {"FAM1": ["P1", "P2"]}),
+            request("r2", {"FAM1": ["P2", "P1"], "FAM2": ["P3"]}),
+        ]
+    )
+    assert merged == {"FAM1": ["P1", "P2"], "FAM2": ["P3"]}
+    assert outputs == {
+        "r1": {"FAM1": "FAM1"},
+        "r2": {"FAM1": "FAM1", "FAM2": "FAM2"},
+    }
+
+
+def test_merge_requests_reused_family_name():
+    merged, outputs = merge_requests(
+        [
+            request("r1", {"FAM1": ["P1"]}),
+            request("r2", {"FAM1": ["P1", "P2"]}),
+            # same samples as the second request, so not extracted again
+            request("r3", {"FAM1": ["P2", "P1"]}),
+            request("r4", {"FAM1": ["P1"]}),
+        ]
+    )
+    assert merged == {"FAM1": ["P1"], "FAM1_r2": ["P1", "P2"]}
+    assert outputs == {
+        "r1": {"FAM1": "FAM1"},
+        "r2": {"FAM1": "FAM1_r2"},
+        "r3": {"FAM1": "FAM1_r2"},
+        "r4": {"FAM1": "FAM1"},
+    }
+
+
+@pytest.fixture()
+def fake_bucket(monkeypatch):
+    bucket = FakeBucket()
+    monkeypatch.setattr(
+        extraction_queue, "queue_bucket", lambda client, dataset: bucket
+    )
+    monkeypatch.setattr(extraction_queue.storage, "Client", lambda: None)
+    monkeypatch.setattr(extraction_queue.hb, "ServiceBackend", lambda **kwargs: None)
+    monkeypatch.setattr(
+        extraction_queue, "estimate_job_size", lambda path, n_samples: {}
+    )
+    yield bucket
+
+
+def test_flush_requeues_on_failure(fake_bucket, monkeypatch):
+    def failing_job(*args, **kwargs):
+        raise RuntimeError("submission failed")
+
+    monkeypatch.setattr(extraction_queue, "add_extraction_job", failing_job)
+    enqueue(fake_bucket, {"FAM1": ["P1"]}, [], NOW)
+    pending_before = sorted(fake_bucket.objects)
+
+    with pytest.raises(RuntimeError):
+        flush("acute-care", 900, 50, force=True, now=NOW)
+
+    # the request is pending again, and no manifest was written
+    assert sorted(fake_bucket.objects) == pending_before
+    assert pending_before[0].startswith(f"{QUEUE_PREFIX}/{PENDING}/")
+
+
+def test_flush_writes_manifest(fake_bucket, monkeypatch):
+    submitted = []
+    monkeypatch.setattr(
+        extraction_queue,
+        "add_extraction_job",
+        lambda batch, script, size, job_name: submitted.append(script),
+    )
+    monkeypatch.setattr(extraction_queue.hb.Batch, "run", lambda self, wait: None)
+    enqueue(fake_bucket, {"FAM1": ["P1"]}, [], NOW)
+    enqueue(fake_bucket, {"FAM2": ["P2"]}, [], NOW)
+
+    flush("acute-care", 900, 50, force=True, now=NOW)
+
+    assert len(submitted) == 1
+    assert "--run_id" in submitted[0]
+    assert not [name for name in fake_bucket.objects if f"/{PENDING}/" in name]
+    assert [name for name in fake_bucket.objects if f"/{BATCHES}/" in name]
+
+
+def test_submit_schedules_flush(fake_bucket, monkeypatch):
+    scheduled = []
+    monkeypatch.setattr(
+        extraction_queue,
+        "schedule_flush",
+        lambda *args: scheduled.append(args),
+    )
+    args = ["--dataset", "acute-care", "--json-str", '{"FAM1":["P1"]}']
+
+    # the request is left waiting, so a delayed flush picks it up
+    result = CliRunner().invoke(submit_command, args + ["--window", "600"])
+    assert result.exit_code == 0, result.output
+    assert scheduled == [("acute-care", 600, 50)]
+
+    # the queue is full, so the request is submitted at once
+    monkeypatch.setattr(
+        extraction_queue, "add_extraction_job", lambda *args, **kwargs: None
+    )
+    monkeypatch.setattr(extraction_queue.hb.Batch, "run", lambda self, wait: None)
+    result = CliRunner().invoke(submit_command, args + ["--max-requests", "2"])
+    assert result.exit_code == 0, result.output
+    assert len(scheduled) == 1
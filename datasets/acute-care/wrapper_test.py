@@ -0,0 +1,80 @@
+import pytest
+
+# import the local methods
+from extraction_wrapper import (
+    LOCAL_MAX_WORK,
+    MAX_SECONDARY_WORKERS,
+    MIN_SECONDARY_WORKERS,
+    PARTITIONS_PER_WORKER,
+    get_option_value,
+    load_families,
+    parse_script_args,
+    runs_locally,
+    secondary_workers_for,
+)
+
+
+"""
+tests for the sizing and routing of extraction jobs, which only need the
+MT dimensions, not the MT itself
+"""
+
+
+def size_for(rows: int, cols: int, n_samples: int) -> dict:
+    """
+    a job size as returned by estimate_job_size
+    """
+    return {
+        "rows": rows,
+        "cols": cols,
+        "partitions": 1,
+        "scanned_entries": rows * cols,
+        "output_entries": rows * n_samples,
+    }
+
+
+@pytest.mark.parametrize(
+    "partitions,expected",
+    [
+        (1, MIN_SECONDARY_WORKERS),
+        (PARTITIONS_PER_WORKER * 10, 10),
+        (PARTITIONS_PER_WORKER * 10 + 1, 11),
+        (PARTITIONS_PER_WORKER * 10_000, MAX_SECONDARY_WORKERS),
+    ],
+)
+def test_secondary_workers_for(partitions, expected):
+    assert secondary_workers_for(partitions) == expected
+
+
+@pytest.mark.parametrize(
+    "json_str",
+    [
+        '{"FAM1":["P1","P2"]}',
+        # as escaped for the dataproc submission
+        '\'{"FAM1":["P1","P2"]}\'',
+    ],
+)
+def test_load_families(json_str):
+    assert load_families(json_str) == {"FAM1": ["P1", "P2"]}
+
+
+def test_parse_script_args():
+    args = [
+        "extract_trio_vcf.py",
+        "--json-str",
+        '\'{"FAM1":["P1"]}\'',
+        "--dataset",
+        "acute-care",
+    ]
+    assert parse_script_args(args) == ("acute-care", {"FAM1": ["P1"]})
+    assert get_option_value(args, "--ref") == ""
+
+
+def test_runs_locally_threshold():
+    # a cohort whose full scan alone fits within the local limit
+    rows, cols = 1_000_000, LOCAL_MAX_WORK // 2_000_000
+    assert runs_locally(size_for(rows, cols, 3))
+    # requesting many more samples adds to the write cost, and moves to dataproc
+    assert not runs_locally(size_for(rows, cols, 1_000))
+    # the whole cohort scan is over the limit, whatever is requested
+    assert not runs_locally(size_for(rows, LOCAL_MAX_WORK // rows + 1, 3))
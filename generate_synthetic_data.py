@@ -0,0 +1,385 @@
+#!/usr/bin/env python
+
+"""
+Generates a synthetic dataset of any size, to exercise prep_inputs_for_combiner.py,
+prep_warp_inputs.smk and datasets/acute-care/families_to_samples.py at scale:
+
+* `samples.ped`: a 1000genomes-style PED with trios, quads, duos and singletons
+  across the 1000genomes populations,
+* `cromwell/`: a Cromwell execution tree of WGSMultipleSamplesFromBam outputs,
+  with a GVCF and Picard QC files per sample, and `work/prep_inputs_for_combiner/
+  found_*.txt` listings of it, so prep_inputs_for_combiner.py skips `gsutil ls`,
+* `phase3/data/`: a 1000genomes phase3-style data tree, and `smk/`, a working
+  directory for prep_warp_inputs.smk with its `gsutil ls` outputs pre-seeded.
+  The listings use the public bucket URL, which the workflow matches paths on,
+* `sm-api/`: responses of the sample-metadata API endpoints used by
+  families_to_samples.py, to serve with e.g. `python -m http.server -d sm-api`.
+
+With --listings-only, the trees are only written as listings, which is enough
+for everything but reading the files, and much faster for 100k samples.
+"""
+
+import json
+import random
+import uuid
+from functools import partial
+from os.path import dirname, join
+from typing import Dict, List, Optional
+
+import click
+
+from prep_inputs_for_combiner import PICARD_SUFFIX_D, safe_mkdir
+
+POPULATIONS = [
+    'ACB', 'ASW', 'CDX', 'CEU', 'CHB', 'CHD', 'CHS', 'CLM', 'FIN', 'GBR', 'GIH',
+    'IBS', 'JPT', 'KHV', 'LWK', 'MKK', 'MXL', 'PEL', 'PUR', 'TSI', 'YRI',
+]
+PED_HEADER = [
+    'Family.ID', 'Individual.ID', 'Paternal.ID', 'Maternal.ID', 'Gender',
+    'Phenotype', 'Population', 'Other.info',
+    'Relationships.from.Pemberton.et.al.AJHG.2010', 'Broad.IBD.Analysis',
+]
+# family size -> probability, roughly as in the 1000genomes pedigree
+FAMILY_SIZES = {1: 0.45, 2: 0.1, 3: 0.35, 4: 0.1}
+PHASE3_FOLDERS = ['alignment', 'exome_alignment', 'sequence_read']
+GS_1GK_DATA_BUCKET = (
+    'gs://genomics-public-data/ftp-trace.ncbi.nih.gov/1000genomes/ftp/phase3/data'
+)
+GVCF_1KG_BUCKET_PATTERN = (
+    'gs://fc-56ac46ea-efc4-4683-b6d5-6d95bed41c5e/CCDG_14151/'
+    'Project_CCDG_14151_B01_GRM_WGS.gVCF.2020-02-12/'
+    'Project_CCDG_14151_B01_GRM_WGS.gVCF.2020-02-12/'
+    'Sample_*/analysis/*.haplotypeCalls.er.raw.vcf.gz'
+)
+GATKSV_CRAM_BUCKET = 'gs://gatk-sv-ref-panel-1kg/cram'
+
+
+def _pedigree_row(
+    rng: random.Random,
+    family_id: str,
+    population: str,
+    sample: str,
+    father: str = '0',
+    mother: str = '0',
+    sex: Optional[str] = None,
+    info: str = '',
+) -> Dict[str, str]:
+    return {
+        'Family.ID': family_id,
+        'Individual.ID': sample,
+        'Paternal.ID': father,
+        'Maternal.ID': mother,
+        'Gender': sex or str(rng.randint(1, 2)),
+        'Phenotype': '0',
+        'Population': population,
+        'Other.info': info,
+        'Relationships.from.Pemberton.et.al.AJHG.2010': '0',
+        'Broad.IBD.Analysis': '',
+    }
+
+
+def generate_pedigree(n_samples: int, rng: random.Random) -> List[Dict[str, str]]:
+    """
+    Families of 1 to 4 individuals, up to n_samples in total. In families of
+    3 and 4, the children have both parents in the PED; in families of 2,
+    the child has one parent.
+    """
+    rows: List[Dict[str, str]] = []
+    family_i = 0
+    while len(rows) < n_samples:
+        family_i += 1
+        family_id = f'SYNF{family_i:06d}'
+        population = rng.choice(POPULATIONS)
+        size = rng.choices(list(FAMILY_SIZES), weights=list(FAMILY_SIZES.values()))[0]
+        size = min(size, n_samples - len(rows))
+        ids = [f'SYN{len(rows) + i + 1:06d}' for i in range(size)]
+        _row = partial(_pedigree_row, rng, family_id, population)
+
+        if size == 1:
+            rows.append(_row(ids[0]))
+        elif size == 2:
+            rows.append(_row(ids[0], mother=ids[1], info='child'))
+            rows.append(_row(ids[1], sex='2', info='mother'))
+        else:
+            father, mother, children = ids[0], ids[1], ids[2:]
+            rows.append(_row(father, sex='1', info='father'))
+            rows.append(_row(mother, sex='2', info='mother'))
+            for child in children:
+                rows.append(_row(child, father=father, mother=mother, info='child'))
+    return rows
+
+
+def write_file(path: str, content: str = ''):
+    safe_mkdir(dirname(path))
+    with open(path, 'w') as f:
+        f.write(content)
+
+
+def picard_metrics(metrics_class: str, rows: List[Dict[str, object]]) -> str:
+    header = list(rows[0])
+    lines = [
+        '## htsjdk.samtools.metrics.StringHeader',
+        '# synthetic',
+        '',
+        f'## METRICS CLASS\t{metrics_class}',
+        '\t'.join(header),
+    ] + ['\t'.join(str(row[h]) for h in header) for row in rows]
+    return '\n'.join(lines) + '\n\n'
+
+
+def qc_file_contents(sample: str, rng: random.Random) -> Dict[str, str]:
+    """
+    Contents of the QC files of a sample, by PICARD_SUFFIX_D key
+    """
+    reads = rng.randint(600_000_000, 900_000_000)
+    return {
+        'contamination': (
+            '#SEQ_ID\tRG\tCHIP_ID\t#SNPS\t#READS\tAVG_DP\tFREEMIX\tFREELK1\tFREELK0\n'
+            f'{sample}\tNA\tNA\t100000\t{reads // 1000}\t'
+            f'{rng.uniform(25, 40):.2f}\t{rng.uniform(0, 0.03):.5f}\t0\t0\n'
+        ),
+        'alignment_summary_metrics': picard_metrics(
+            'picard.analysis.AlignmentSummaryMetrics',
+            [
+                {'CATEGORY': category, 'TOTAL_READS': reads // divisor,
+                 'PCT_PF_READS_ALIGNED': f'{rng.uniform(0.97, 1):.6f}',
+                 'SAMPLE': '', 'LIBRARY': '', 'READ_GROUP': ''}
+                for category, divisor in
+                [('FIRST_OF_PAIR', 2), ('SECOND_OF_PAIR', 2), ('PAIR', 1)]
+            ],
+        ),
+        'duplicate_metrics': picard_metrics(
+            'picard.sam.DuplicationMetrics',
+            [{'LIBRARY': sample, 'READ_PAIRS_EXAMINED': reads // 2,
+              'PERCENT_DUPLICATION': f'{rng.uniform(0.05, 0.2):.6f}',
+              'ESTIMATED_LIBRARY_SIZE': '?'}],
+        ),
+        'insert_size_metrics': picard_metrics(
+            'picard.analysis.InsertSizeMetrics',
+            [{'MEDIAN_INSERT_SIZE': rng.randint(350, 450),
+              'MEAN_INSERT_SIZE': f'{rng.uniform(350, 450):.3f}',
+              'PAIR_ORIENTATION': 'FR'}],
+        ),
+        'wgs_metrics': picard_metrics(
+            'picard.analysis.WgsMetrics',
+            [{'GENOME_TERRITORY': 2745186691,
+              'MEAN_COVERAGE': f'{rng.uniform(25, 40):.6f}',
+              'PCT_30X': f'{rng.uniform(0.4, 0.8):.6f}'}],
+        ),
+    }
+
+
+def generate_cromwell_tree(
+    out_dir: str,
+    samples: List[str],
+    rng: random.Random,
+    missing_rate: float,
+    listings_only: bool,
+):
+    """
+    Writes WGSMultipleSamplesFromBam outputs, and the `gsutil ls` listings of
+    them that prep_inputs_for_combiner.py reads from its work directory
+    """
+    workflow_dir = join(
+        out_dir, 'cromwell', 'WGSMultipleSamplesFromBam',
+        str(uuid.UUID(int=rng.getrandbits(128))),
+    )
+    listings: Dict[str, List[str]] = {key: [] for key in ['gvcfs', *PICARD_SUFFIX_D]}
+    for shard, sample in enumerate(samples):
+        if rng.random() < missing_rate:
+            continue
+        subworkflow_dir = join(
+            workflow_dir, 'call-WGSFromBam', f'shard-{shard}', 'WGSFromBam',
+            str(uuid.UUID(int=rng.getrandbits(128))),
+        )
+        paths = {
+            'gvcfs': join(
+                subworkflow_dir, 'call-MergeVCFs', f'{sample}.g.vcf.gz'
+            ),
+            'contamination': join(
+                subworkflow_dir, 'call-CheckContamination', f'{sample}.selfSM'
+            ),
+            'alignment_summary_metrics': join(
+                subworkflow_dir, 'call-CollectAggregationMetrics',
+                f'{sample}.alignment_summary_metrics',
+            ),
+            'insert_size_metrics': join(
+                subworkflow_dir, 'call-CollectAggregationMetrics',
+                f'{sample}.insert_size_metrics',
+            ),
+            'duplicate_metrics': join(
+                subworkflow_dir, 'call-MarkDuplicates', f'{sample}.duplicate_metrics'
+            ),
+            'wgs_metrics': join(
+                subworkflow_dir, 'call-CollectWgsMetrics', f'{sample}.wgs_metrics'
+            ),
+        }
+        contents = qc_file_contents(sample, rng)
+        for key, path in paths.items():
+            listings[key].append(path)
+            if not listings_only:
+                write_file(path, contents.get(key, ''))
+                if key == 'gvcfs':
+                    write_file(path + '.tbi')
+
+    work_dir = safe_mkdir(join(out_dir, 'work', 'prep_inputs_for_combiner'))
+    for key, paths in listings.items():
+        write_file(join(work_dir, f'found_{key}.txt'), ''.join(p + '\n' for p in paths))
+
+
+def generate_phase3_tree(
+    out_dir: str,
+    ped_rows: List[Dict[str, str]],
+    rng: random.Random,
+    listings_only: bool,
+):
+    """
+    Writes a phase3-style data tree, and a working directory for
+    prep_warp_inputs.smk with the outputs of its listing rules
+    """
+    smk_dir = safe_mkdir(join(out_dir, 'smk'))
+    data_ls, gvcf_ls, crams = [], [], []
+    for row in ped_rows:
+        sample = row['Individual.ID']
+        folders = [f for f in PHASE3_FOLDERS if rng.random() < 0.9]
+        data_ls.append(f'{GS_1GK_DATA_BUCKET}/{sample}/:\n')
+        for folder in folders:
+            data_ls.append(f'{GS_1GK_DATA_BUCKET}/{sample}/{folder}/\n')
+            if not listings_only:
+                bam = (
+                    f'{sample}.mapped.ILLUMINA.bwa.{row["Population"]}.'
+                    f'{"exome" if folder == "exome_alignment" else "low_coverage"}'
+                    f'.20120522.bam'
+                )
+                write_file(join(out_dir, 'phase3', 'data', sample, folder, bam))
+        if rng.random() < 0.8:
+            gvcf_ls.append(GVCF_1KG_BUCKET_PATTERN.replace('*', sample) + '\n')
+        if rng.random() < 0.05:
+            crams.append(f'{GATKSV_CRAM_BUCKET}/{sample}.final.cram\n')
+
+    write_file(join(smk_dir, 'resources', 'gs-phase3-data-ls.txt'), ''.join(data_ls))
+    write_file(join(smk_dir, 'resources', 'gs-gvcfs.txt'), ''.join(gvcf_ls))
+    write_file(join(smk_dir, 'work', 'gatksv-data.txt'), ''.join(crams))
+    write_file(join(smk_dir, 'resources', 'G1K_samples.ped'), ped_to_tsv(ped_rows))
+
+
+def generate_sm_api(out_dir: str, ped_rows: List[Dict[str, str]], project: str):
+    """
+    Writes the responses of the sample-metadata endpoints used by
+    families_to_samples.py, at their URL paths
+    """
+    api_dir = join(out_dir, 'sm-api')
+    pedigree = ['#Family ID\tIndividual ID\tPaternal ID\tMaternal ID\tSex\tAffected']
+    for row in ped_rows:
+        is_child = row['Paternal.ID'] != '0' or row['Maternal.ID'] != '0'
+        pedigree.append('\t'.join([
+            row['Family.ID'],
+            row['Individual.ID'],
+            '' if row['Paternal.ID'] == '0' else row['Paternal.ID'],
+            '' if row['Maternal.ID'] == '0' else row['Maternal.ID'],
+            row['Gender'],
+            '2' if is_child else '1',
+        ]))
+    pid_to_sample = [
+        [row['Individual.ID'], f'CPG{i + 1}'] for i, row in enumerate(ped_rows)
+    ]
+    write_file(
+        join(api_dir, 'family', project, 'pedigree'), '\n'.join(pedigree) + '\n'
+    )
+    write_file(
+        join(api_dir, 'participant', project, 'external-pid-to-internal-sample-id'),
+        json.dumps(pid_to_sample),
+    )
+    write_file(
+        join(api_dir, 'sample', project, 'id-map', 'internal', 'all'),
+        json.dumps({cpg_id: pid for pid, cpg_id in pid_to_sample}),
+    )
+
+
+def ped_to_tsv(ped_rows: List[Dict[str, str]]) -> str:
+    lines = ['\t'.join(PED_HEADER)]
+    lines += ['\t'.join(row[h] for h in PED_HEADER) for row in ped_rows]
+    return '\n'.join(lines) + '\n'
+
+
+def generate(
+    out_dir: str,
+    n_samples: int,
+    seed: int = 1,
+    missing_rate: float = 0.01,
+    listings_only: bool = False,
+    project: str = 'synthetic',
+) -> List[Dict[str, str]]:
+    """
+    Writes the whole synthetic dataset into out_dir
+    :return: PED rows
+    """
+    rng = random.Random(seed)
+    ped_rows = generate_pedigree(n_samples, rng)
+    write_file(join(out_dir, 'samples.ped'), ped_to_tsv(ped_rows))
+    samples = [row['Individual.ID'] for row in ped_rows]
+    generate_cromwell_tree(out_dir, samples, rng, missing_rate, listings_only)
+    generate_phase3_tree(out_dir, ped_rows, rng, listings_only)
+    generate_sm_api(out_dir, ped_rows, project)
+    return ped_rows
+
+
+@click.command()
+@click.option(
+    '-n',
+    '--samples',
+    'n_samples',
+    required=True,
+    type=click.INT,
+    help='Number of samples to generate.'
+)
+@click.option(
+    '--out-dir',
+    'out_dir',
+    help='Output folder. Default is "work/synthetic/{n_samples}".'
+)
+@click.option(
+    '--seed',
+    'seed',
+    default=1,
+    type=click.INT,
+    help='Random seed, the same seed generates the same dataset.'
+)
+@click.option(
+    '--missing-rate',
+    'missing_rate',
+    default=0.01,
+    type=click.FLOAT,
+    help='Fraction of samples without Cromwell outputs. Default is 0.01.'
+)
+@click.option(
+    '--listings-only',
+    'listings_only',
+    is_flag=True,
+    help='Only write listings of the Cromwell and phase3 trees, not the files.'
+)
+@click.option(
+    '--project',
+    'project',
+    default='synthetic',
+    help='Project name in the sample-metadata API paths.'
+)
+def main(
+    n_samples: int,
+    out_dir: str,
+    seed: int,
+    missing_rate: float,
+    listings_only: bool,
+    project: str,
+):
+    """
+    Generate a synthetic dataset
+    """
+    out_dir = out_dir or join('work', 'synthetic', str(n_samples))
+    ped_rows = generate(out_dir, n_samples, seed, missing_rate, listings_only, project)
+    n_families = len({row['Family.ID'] for row in ped_rows})
+    print(f'Generated {len(ped_rows)} samples in {n_families} families in {out_dir}')
+
+
+if __name__ == '__main__':
+    main()  # pylint: disable=E1120
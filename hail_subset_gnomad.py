@@ -1,6 +1,3 @@
-import os
-import hail as hl
-import pandas as pd
 import click
 import random
 
@@ -16,6 +13,10 @@ mt_src_path = \
 def main(trg_path, ped_path, n, clean):
     assert ped_path or n
 
+    # hail and pandas take seconds to import, so only load them to do the work
+    import hail as hl
+    import pandas as pd
+
     hl.init(default_reference='GRCh38')
     mt = hl.read_matrix_table(mt_src_path)
 
@@ -35,4 +36,6 @@ def main(trg_path, ped_path, n, clean):
 
     mt.write(trg_path, overwrite=True)
 
-main()
\ No newline at end of file
+
+if __name__ == '__main__':
+    main()  # pylint: disable=E1120
@@ -0,0 +1,268 @@
+#!/usr/bin/env python
+
+"""
+Collects the Picard and VerifyBamID QC files listed in a sample map into a
+single typed table keyed by sample, so sample QC can do one read instead of
+fetching 5 small files per sample
+"""
+
+import logging
+import re
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from os.path import join
+from typing import Dict, List, Optional, Tuple
+
+import click
+import pandas as pd
+from google.cloud import storage
+
+from prep_inputs_for_combiner import PICARD_SUFFIX_D, safe_mkdir
+
+logger = logging.getLogger('ingest_qc_metrics')
+logger.setLevel('INFO')
+
+# for multi-row metrics, the row describing the whole sample
+SUMMARY_ROW = {
+    'alignment_summary_metrics': ('CATEGORY', 'PAIR'),
+    'insert_size_metrics': ('PAIR_ORIENTATION', 'FR'),
+}
+# duplicate metrics have one row per library, these counts are summed
+DUPLICATE_COUNT_FIELDS = [
+    'UNPAIRED_READS_EXAMINED',
+    'READ_PAIRS_EXAMINED',
+    'SECONDARY_OR_SUPPLEMENTARY_RDS',
+    'UNMAPPED_READS',
+    'UNPAIRED_READ_DUPLICATES',
+    'READ_PAIR_DUPLICATES',
+    'READ_PAIR_OPTICAL_DUPLICATES',
+    'ESTIMATED_LIBRARY_SIZE',
+]
+
+
+def read_text(client: Optional[storage.Client], path: str) -> str:
+    if path.startswith('gs://'):
+        bucket, name = path[len('gs://'):].split('/', maxsplit=1)
+        return client.bucket(bucket).blob(name).download_as_text()
+    with open(path) as f:
+        return f.read()
+
+
+def parse_picard_metrics(text: str) -> List[Dict[str, str]]:
+    """
+    Parses the METRICS CLASS section of a Picard metrics file into rows
+    """
+    lines = text.splitlines()
+    start = next(
+        (i for i, line in enumerate(lines) if line.startswith('## METRICS CLASS')),
+        None,
+    )
+    if start is None or start + 1 >= len(lines):
+        return []
+    header = lines[start + 1].split('\t')
+    rows = []
+    for line in lines[start + 2:]:
+        if not line.strip() or line.startswith('#'):
+            break
+        rows.append(dict(zip(header, line.split('\t'))))
+    return rows
+
+
+def parse_self_sm(text: str) -> List[Dict[str, str]]:
+    """
+    Parses a VerifyBamID selfSM file, which has a '#'-prefixed header line
+    """
+    lines = [line for line in text.splitlines() if line.strip()]
+    if len(lines) < 2:
+        return []
+    header = lines[0].lstrip('#').split('\t')
+    return [dict(zip(header, line.split('\t'))) for line in lines[1:]]
+
+
+def combine_duplicate_metrics(rows: List[Dict[str, str]]) -> Dict[str, str]:
+    """
+    Combines the per-library rows of a Picard duplicate metrics file into one,
+    summing the counts and recomputing PERCENT_DUPLICATION as Picard does
+    """
+    if len(rows) == 1:
+        return rows[0]
+    counts = {
+        field: sum(int(row.get(field) or 0) for row in rows)
+        for field in DUPLICATE_COUNT_FIELDS
+    }
+    examined = counts['UNPAIRED_READS_EXAMINED'] + 2 * counts['READ_PAIRS_EXAMINED']
+    duplicates = (
+        counts['UNPAIRED_READ_DUPLICATES'] + 2 * counts['READ_PAIR_DUPLICATES']
+    )
+    combined = {'LIBRARY': ','.join(row.get('LIBRARY', '') for row in rows)}
+    combined.update({field: str(count) for field, count in counts.items()})
+    combined['PERCENT_DUPLICATION'] = str(duplicates / examined if examined else 0)
+    return combined
+
+
+def parse_qc_file(key: str, text: str) -> Dict[str, str]:
+    """
+    Parses a single QC file into the metrics for its sample,
+    with columns prefixed by the QC file type
+    """
+    rows = parse_self_sm(text) if key == 'contamination' else parse_picard_metrics(text)
+    if not rows:
+        raise ValueError('no metrics found')
+    row = rows[0]
+    if key == 'duplicate_metrics':
+        row = combine_duplicate_metrics(rows)
+    elif key in SUMMARY_ROW:
+        field, value = SUMMARY_ROW[key]
+        row = next((r for r in rows if r.get(field) == value), rows[-1])
+    return {
+        f'{key}_{re.sub(r"[^0-9a-z]+", "_", field.lower()).strip("_")}': value
+        for field, value in row.items()
+    }
+
+
+def fetch_and_parse(
+    client: Optional[storage.Client], sample: str, key: str, path: str
+) -> Tuple[str, Dict[str, str], Optional[str]]:
+    """
+    :return: the sample, its metrics, and an error message if the file
+        couldn't be read or parsed
+    """
+    try:
+        return sample, parse_qc_file(key, read_text(client, path)), None
+    except Exception as e:  # pylint: disable=broad-except
+        return sample, {}, f'Could not read {key} for {sample} from {path}: {e}'
+
+
+def to_typed_frame(metrics_by_sample: Dict[str, Dict[str, str]]) -> pd.DataFrame:
+    """
+    Builds a frame keyed by sample, with numeric columns converted to numbers.
+    Picard writes missing values as '?'.
+    """
+    df = pd.DataFrame.from_dict(metrics_by_sample, orient='index')
+    df.index.name = 's'
+    df = df.replace({'?': None, '': None})
+    for col in df.columns:
+        converted = pd.to_numeric(df[col], errors='coerce')
+        if converted.notna().sum() == df[col].notna().sum():
+            df[col] = converted
+    return df.reset_index()
+
+
+def ingest(
+    sample_map_path: str, threads: int = 32
+) -> Tuple[pd.DataFrame, List[str]]:
+    """
+    Fetches and parses all QC files in the sample map concurrently
+    :return: the metrics table, and the errors of QC files that failed
+    """
+    sample_map = pd.read_csv(sample_map_path, dtype=str, keep_default_na=False)
+    tasks = [
+        (row['sample'], key, row[key])
+        for _, row in sample_map.iterrows()
+        for key in PICARD_SUFFIX_D
+        if row.get(key)
+    ]
+    # local files don't need GCS credentials
+    client = None
+    if any(path.startswith('gs://') for _, _, path in tasks):
+        client = storage.Client()
+    metrics_by_sample: Dict[str, Dict[str, str]] = {
+        s: {} for s in sample_map['sample']
+    }
+    errors = []
+    with ThreadPoolExecutor(threads) as executor:
+        for sample, metrics, error in executor.map(
+            lambda task: fetch_and_parse(client, *task), tasks
+        ):
+            metrics_by_sample[sample].update(metrics)
+            if error:
+                errors.append(error)
+    logger.info(
+        f'Parsed {len(tasks) - len(errors)} of {len(tasks)} QC files '
+        f'for {len(metrics_by_sample)} samples'
+    )
+    return to_typed_frame(metrics_by_sample), errors
+
+
+@click.command()
+@click.option(
+    '--dataset',
+    'dataset_name',
+    required=True,
+    help='Dataset name, e.g. "50genomes". Reads '
+         '`{datasets_dir}/{dataset_name}/sample-maps/{dataset_name}-all.csv`, '
+         'unless --sample-map is specified explicitly.'
+)
+@click.option(
+    '--sample-map',
+    'sample_map',
+    help='Sample map CSV with a column of QC file paths per QC file type.'
+)
+@click.option(
+    '--datasets-dir',
+    'datasets_dir',
+    default='datasets',
+    help='Datasets folder. Default is "datasets/".'
+)
+@click.option(
+    '--out',
+    'out_path',
+    help='Output path, ending with .parquet or .ht. Default is '
+         '`{datasets_dir}/{dataset_name}/qc/{dataset_name}-qc.parquet`.'
+)
+@click.option(
+    '--threads',
+    'threads',
+    default=32,
+    type=click.INT,
+    help='Number of QC files to fetch concurrently.'
+)
+@click.option(
+    '--allow-missing',
+    'allow_missing',
+    is_flag=True,
+    help='Write the table even if some QC files could not be read, leaving '
+         'their metrics empty. By default, any failure stops without writing.'
+)
+def main(
+    dataset_name: str,
+    sample_map: Optional[str],
+    datasets_dir: str,
+    out_path: Optional[str],
+    threads: int,
+    allow_missing: bool,
+):
+    """
+    Ingest the QC files of a dataset into a single table
+    """
+    sample_map = sample_map or join(
+        datasets_dir, dataset_name, 'sample-maps', f'{dataset_name}-all.csv'
+    )
+    if not out_path:
+        out_path = join(
+            safe_mkdir(join(datasets_dir, dataset_name, 'qc')),
+            f'{dataset_name}-qc.parquet',
+        )
+
+    df, errors = ingest(sample_map, threads)
+    for error in errors:
+        logger.error(error)
+    if errors and not allow_missing:
+        logger.error(
+            f'{len(errors)} QC files could not be read, not writing {out_path}. '
+            f'Use --allow-missing to write the table without them.'
+        )
+        sys.exit(1)
+    if out_path.endswith('.ht'):
+        import hail as hl
+
+        hl.init(default_reference='GRCh38')
+        hl.Table.from_pandas(df, key='s').write(out_path, overwrite=True)
+    else:
+        df.to_parquet(out_path, index=False)
+    logger.info(f'Written {len(df)} samples to {out_path}')
+
+
+if __name__ == '__main__':
+    logging.basicConfig()
+    main()  # pylint: disable=E1120
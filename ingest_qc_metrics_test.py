@@ -0,0 +1,59 @@
+import pytest
+
+from ingest_qc_metrics import fetch_and_parse, parse_qc_file
+
+
+"""
+tests for parsing single QC files into per-sample metrics
+"""
+
+
+DUPLICATE_METRICS = (
+    "## htsjdk.samtools.metrics.StringHeader\n"
+    "# MarkDuplicates INPUT=[sample.bam]\n"
+    "\n"
+    "## METRICS CLASS\tpicard.sam.DuplicationMetrics\n"
+    "LIBRARY\tUNPAIRED_READS_EXAMINED\tREAD_PAIRS_EXAMINED\t"
+    "SECONDARY_OR_SUPPLEMENTARY_RDS\tUNMAPPED_READS\tUNPAIRED_READ_DUPLICATES\t"
+    "READ_PAIR_DUPLICATES\tREAD_PAIR_OPTICAL_DUPLICATES\tPERCENT_DUPLICATION\t"
+    "ESTIMATED_LIBRARY_SIZE\n"
+    "LIB1\t100\t1000\t0\t10\t10\t100\t5\t0.114286\t5000\n"
+    "LIB2\t0\t1000\t0\t10\t0\t200\t5\t0.2\t3000\n"
+    "\n"
+    "## HISTOGRAM\tjava.lang.Double\n"
+    "BIN\tVALUE\n"
+    "1.0\t1.0\n"
+)
+SELF_SM = (
+    "#SEQ_ID\tRG\tCHIP_ID\t#SNPS\t#READS\tAVG_DP\tFREEMIX\n"
+    "SAMPLE1\tNA\tNA\t1000\t20000\t20.0\t0.012\n"
+)
+
+
+def test_duplicate_metrics_combines_libraries():
+    metrics = parse_qc_file("duplicate_metrics", DUPLICATE_METRICS)
+    assert metrics["duplicate_metrics_library"] == "LIB1,LIB2"
+    assert metrics["duplicate_metrics_read_pairs_examined"] == "2000"
+    assert metrics["duplicate_metrics_read_pair_duplicates"] == "300"
+    # (10 + 2 * 300) / (100 + 2 * 2000)
+    assert float(metrics["duplicate_metrics_percent_duplication"]) == pytest.approx(
+        610 / 4100
+    )
+
+
+def test_self_sm():
+    metrics = parse_qc_file("contamination", SELF_SM)
+    assert metrics["contamination_freemix"] == "0.012"
+    assert metrics["contamination_snps"] == "1000"
+
+
+def test_fetch_and_parse_reports_errors(tmp_path):
+    path = tmp_path / "sample.wgs_metrics"
+    path.write_text("not a metrics file\n")
+    sample, metrics, error = fetch_and_parse(None, "SAMPLE1", "wgs_metrics", str(path))
+    assert (sample, metrics) == ("SAMPLE1", {})
+    assert "no metrics found" in error
+    _, _, error = fetch_and_parse(
+        None, "SAMPLE1", "wgs_metrics", str(tmp_path / "missing")
+    )
+    assert error.startswith("Could not read wgs_metrics for SAMPLE1")
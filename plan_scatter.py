@@ -0,0 +1,300 @@
+#!/usr/bin/env python
+
+"""
+Recommends a scatter count for joint calling a dataset, from the number of
+samples and the total size of their GVCFs, and splits the genome into that many
+intervals of equal length. The GVCFs are taken from a sample map, or listed
+from the folder the joint calling reads, e.g. gs://cpg-fewgenomes-test/gvcf/batch1/
+
+Each shard is modelled to take
+    overhead + (per_sample * n_samples + per_gb * gvcf_gb) / scatter_count
+seconds. The scatter count is the smallest one which keeps shards under the
+target time. The default coefficients are rough; they are refitted by least
+squares when a TSV of past runs is available, with the columns:
+    n_samples  gvcf_gb  scatter_count  shard_seconds
+where shard_seconds is the mean wall time of a shard in that run.
+
+Prints the scatter count to stdout, so it can be used from the Makefile.
+"""
+
+import csv
+import glob
+import logging
+import math
+import os
+from collections import defaultdict
+from os.path import dirname, exists, join
+from typing import Dict, List, Optional, Tuple
+
+import click
+import numpy as np
+from google.cloud import storage
+
+logger = logging.getLogger('plan_scatter')
+logger.setLevel('INFO')
+
+# overhead, per_sample, per_gb, in seconds
+DEFAULT_COEFFICIENTS = (300.0, 60.0, 120.0)
+DEFAULT_TIMINGS = 'scatter_timings.tsv'
+
+# GRCh38 primary contigs, which joint calling is scattered over
+GRCH38_LENGTHS = {
+    'chr1': 248956422, 'chr2': 242193529, 'chr3': 198295559,
+    'chr4': 190214555, 'chr5': 181538259, 'chr6': 170805979,
+    'chr7': 159345973, 'chr8': 145138636, 'chr9': 138394717,
+    'chr10': 133797422, 'chr11': 135086622, 'chr12': 133275309,
+    'chr13': 114364328, 'chr14': 107043718, 'chr15': 101991189,
+    'chr16': 90338345, 'chr17': 83257441, 'chr18': 80373285,
+    'chr19': 58617616, 'chr20': 64444167, 'chr21': 46709983,
+    'chr22': 50818468, 'chrX': 156040895, 'chrY': 57227415,
+}
+
+
+def get_gvcf_sizes(paths: List[str]) -> Dict[str, int]:
+    """
+    Looks up GVCF sizes by listing each folder once, rather than
+    requesting each object's metadata separately
+    """
+    wanted = set(paths)
+    sizes = {}
+    gcs_paths_by_folder = defaultdict(set)
+    for path in wanted:
+        if path.startswith('gs://'):
+            gcs_paths_by_folder[dirname(path)].add(path)
+        elif exists(path):
+            sizes[path] = os.path.getsize(path)
+    if gcs_paths_by_folder:
+        client = storage.Client()
+        for folder in gcs_paths_by_folder:
+            bucket_name, _, prefix = folder[len('gs://'):].partition('/')
+            blobs = client.list_blobs(bucket_name, prefix=prefix and f'{prefix}/')
+            for blob in blobs:
+                path = f'gs://{bucket_name}/{blob.name}'
+                if path in wanted:
+                    sizes[path] = blob.size
+    return sizes
+
+
+def list_gvcf_sizes(prefix: str) -> Dict[str, int]:
+    """
+    Sizes of all GVCFs in a folder, local or on GCS, from a single listing
+    """
+    if not prefix.startswith('gs://'):
+        return {
+            path: os.path.getsize(path)
+            for path in glob.glob(join(prefix, '*.g.vcf.gz'))
+        }
+    bucket_name, _, folder = prefix[len('gs://'):].partition('/')
+    folder = folder.rstrip('/')
+    return {
+        f'gs://{bucket_name}/{blob.name}': blob.size
+        for blob in storage.Client().list_blobs(
+            bucket_name, prefix=folder and f'{folder}/'
+        )
+        if blob.name.endswith('.g.vcf.gz')
+    }
+
+
+def fit_coefficients(timings_path: str) -> Tuple[float, float, float]:
+    """
+    Fits the cost model to past runs by least squares. Falls back to the
+    defaults when there are too few runs, or the fit isn't physical.
+    """
+    with open(timings_path) as f:
+        runs = list(csv.DictReader(f, delimiter='\t'))
+    if len(runs) < 3:
+        logger.warning(
+            f'{len(runs)} runs in {timings_path}, need at least 3 to calibrate, '
+            f'using the default cost model'
+        )
+        return DEFAULT_COEFFICIENTS
+    a = np.array([
+        [1.0,
+         float(run['n_samples']) / float(run['scatter_count']),
+         float(run['gvcf_gb']) / float(run['scatter_count'])]
+        for run in runs
+    ])
+    b = np.array([float(run['shard_seconds']) for run in runs])
+    coefficients, _, rank, _ = np.linalg.lstsq(a, b, rcond=None)
+    if rank < 3 or (coefficients < 0).any():
+        logger.warning(
+            f'Could not calibrate from {timings_path} (fit: {coefficients}), '
+            f'using the default cost model'
+        )
+        return DEFAULT_COEFFICIENTS
+    return tuple(float(c) for c in coefficients)  # type: ignore
+
+
+def plan_scatter_count(
+    n_samples: int,
+    gvcf_gb: float,
+    coefficients: Tuple[float, float, float],
+    target_seconds: float,
+    min_count: int = 1,
+    max_count: int = 1000,
+) -> int:
+    """
+    Smallest scatter count which keeps the modelled shard time under the target
+    """
+    overhead, per_sample, per_gb = coefficients
+    work = per_sample * n_samples + per_gb * gvcf_gb
+    if target_seconds <= overhead:
+        return max_count
+    scatter_count = math.ceil(work / (target_seconds - overhead))
+    return max(min_count, min(max_count, scatter_count))
+
+
+def split_intervals(
+    scatter_count: int, lengths: Optional[Dict[str, int]] = None
+) -> List[Tuple[str, int, int, int]]:
+    """
+    Splits the contigs into scatter_count shards of equal total length,
+    as 0-based half-open (contig, start, end, shard). An interval never spans
+    two contigs, so a shard may get several intervals.
+    """
+    lengths = lengths or GRCH38_LENGTHS
+    genome_length = sum(lengths.values())
+    intervals = []
+    offset = 0
+    for contig, length in lengths.items():
+        start = 0
+        while start < length:
+            shard = offset * scatter_count // genome_length
+            shard_end = math.ceil((shard + 1) * genome_length / scatter_count)
+            end = min(length, start + shard_end - offset)
+            intervals.append((contig, start, end, shard))
+            offset += end - start
+            start = end
+    return intervals
+
+
+@click.command()
+@click.option(
+    '--dataset',
+    'dataset_name',
+    help='Dataset name, e.g. "50genomes-gvcf". Reads '
+         '`{datasets_dir}/{dataset_name}/sample-maps/{dataset_name}-all.csv`, '
+         'unless --sample-map is specified explicitly.'
+)
+@click.option(
+    '--sample-map',
+    'sample_map',
+    help='Sample map CSV with `sample` and `gvcf` columns.'
+)
+@click.option(
+    '--gvcfs',
+    'gvcfs_prefix',
+    help='Folder with the GVCFs to joint-call, local or on GCS, instead of a '
+         'sample map, e.g. "gs://cpg-fewgenomes-test/gvcf/batch1/".'
+)
+@click.option(
+    '--datasets-dir',
+    'datasets_dir',
+    default='datasets',
+    help='Datasets folder. Default is "datasets/".'
+)
+@click.option(
+    '--timings',
+    'timings_path',
+    default=DEFAULT_TIMINGS,
+    help=f'TSV of past runs to calibrate the cost model. Default is '
+         f'"{DEFAULT_TIMINGS}"; the default cost model is used if it doesn\'t exist.'
+)
+@click.option(
+    '--target-minutes',
+    'target_minutes',
+    default=30.0,
+    type=click.FLOAT,
+    help='Target wall time of a shard. Default is 30 minutes.'
+)
+@click.option(
+    '--min-count',
+    'min_count',
+    default=1,
+    type=click.INT,
+    help='Minimum scatter count.'
+)
+@click.option(
+    '--max-count',
+    'max_count',
+    default=1000,
+    type=click.INT,
+    help='Maximum scatter count.'
+)
+@click.option(
+    '--intervals-out',
+    'intervals_out',
+    help='Write the interval split to this BED file, with the shard number '
+         'in the 4th column.'
+)
+def main(
+    dataset_name: Optional[str],
+    sample_map: Optional[str],
+    gvcfs_prefix: Optional[str],
+    datasets_dir: str,
+    timings_path: str,
+    target_minutes: float,
+    min_count: int,
+    max_count: int,
+    intervals_out: Optional[str],
+):
+    """
+    Recommend a scatter count for joint calling a dataset
+    """
+    if gvcfs_prefix:
+        sizes = list_gvcf_sizes(gvcfs_prefix)
+        gvcf_paths = list(sizes)
+        if not sizes:
+            raise click.ClickException(f'No GVCFs found in {gvcfs_prefix}')
+    else:
+        if not sample_map and not dataset_name:
+            raise click.ClickException('Specify --dataset, --sample-map or --gvcfs')
+        sample_map = sample_map or join(
+            datasets_dir, dataset_name, 'sample-maps', f'{dataset_name}-all.csv'
+        )
+        with open(sample_map, newline='') as f:
+            gvcf_paths = [row['gvcf'] for row in csv.DictReader(f)]
+        sizes = get_gvcf_sizes(gvcf_paths)
+        if not sizes:
+            raise click.ClickException(f'None of the GVCFs in {sample_map} were found')
+        if len(sizes) < len(gvcf_paths):
+            logger.warning(
+                f'{len(gvcf_paths) - len(sizes)} GVCFs not found, '
+                f'assuming the median size for them'
+            )
+    gvcf_gb = (
+        sum(sizes.values())
+        + (len(gvcf_paths) - len(sizes)) * float(np.median(list(sizes.values())))
+    ) / 1024 ** 3
+
+    coefficients = DEFAULT_COEFFICIENTS
+    if exists(timings_path):
+        coefficients = fit_coefficients(timings_path)
+    scatter_count = plan_scatter_count(
+        len(gvcf_paths),
+        gvcf_gb,
+        coefficients,
+        target_minutes * 60,
+        min_count=min_count,
+        max_count=max_count,
+    )
+    overhead, per_sample, per_gb = coefficients
+    shard_seconds = overhead + (
+        per_sample * len(gvcf_paths) + per_gb * gvcf_gb
+    ) / scatter_count
+    logger.info(
+        f'{len(gvcf_paths)} samples, {gvcf_gb:.1f} GB of GVCFs. Cost model: '
+        f'{overhead:.0f}s + ({per_sample:.1f}s/sample, {per_gb:.1f}s/GB) / shards. '
+        f'Planned {scatter_count} shards of ~{shard_seconds / 60:.1f} minutes'
+    )
+
+    if intervals_out:
+        with open(intervals_out, 'w') as out:
+            for contig, start, end, shard in split_intervals(scatter_count):
+                out.write(f'{contig}\t{start}\t{end}\t{shard}\n')
+    print(scatter_count)
+
+
+if __name__ == '__main__':
+    logging.basicConfig()
+    main()  # pylint: disable=E1120
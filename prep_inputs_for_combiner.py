@@ -12,10 +12,11 @@ from collections import defaultdict
 import csv
 from os.path import isdir, isfile, exists, basename, dirname, join
 import click
-import pandas as pd
-from google.cloud import storage
 import logging
 
+# pandas and google.cloud.storage are imported where they're used, so --help and
+# early failures don't pay for loading them
+
 logger = logging.getLogger('prep_cpg_qc_inputs')
 logger.setLevel('INFO')
 
@@ -57,13 +58,13 @@ def _find_gcs_files(warp_executions_bucket, work_dir, file_suffix, file_key):
 
 def _randomise_pop_labels(sample_df):
     # Adding population labels for 2/3 of the samples in a group;
-    # the rest will be used to test the ancestry inferring methods
-    return list(
-        sample_df\
-            .groupby(['Population']) \
-            .apply(lambda x: x.iloc[:int(x['Population'].size / 1.5)]) \
-            ['Individual.ID']
-    )
+    # the rest will be used to test the ancestry inferring methods.
+    # Samples without a population aren't grouped, so have a size of 0
+    # and are never labelled
+    by_population = sample_df.groupby('Population')
+    group_sizes = by_population['Individual.ID'].transform('size').fillna(0)
+    is_labelled = by_population.cumcount() < (group_sizes / 1.5).astype(int)
+    return set(sample_df['Individual.ID'][is_labelled])
 
 
 def _move_locally(gvcf_by_sample, dataset, picard_file_by_sname_by_key):
@@ -140,6 +141,13 @@ def _move_locally(gvcf_by_sample, dataset, picard_file_by_sname_by_key):
     is_flag=True,
     help='Move GVCFs and picard files to the gs://cpg-fewgenomes-upload bucket.'
 )
+@click.option(
+    '--validate-gvcfs',
+    'validate_gvcfs',
+    is_flag=True,
+    help='Check each GVCF, its index and sample name with ranged reads, '
+         'and leave out samples with invalid GVCFs.'
+)
 def main(
     dataset_name: str,
     samples_ped: str,
@@ -149,6 +157,7 @@ def main(
     split_rounds: bool = False,
     randomise_pop_labels: bool = False,
     move_locally: bool = False,
+    validate_gvcfs: bool = False,
 ):
     """
     Generate test inputs for the combine_gvcfs.py script
@@ -158,12 +167,14 @@ def main(
 
     if not samples_ped:
         samples_ped = os.path.join(datasets_dir, dataset_name, 'samples.ped')
-    try:
-        sample_df = pd.read_csv(samples_ped, sep='\t')
-    except FileNotFoundError:
+    if not isfile(samples_ped):
         logger.error(f'Could not read file {samples_ped}')
         sys.exit(1)
 
+    import pandas as pd
+
+    sample_df = pd.read_csv(samples_ped, sep='\t')
+
     samples_with_pop_labels = None
     if randomise_pop_labels:
         samples_with_pop_labels = _randomise_pop_labels(sample_df)
@@ -196,6 +207,18 @@ def main(
     #     logger.error(f'ERROR: could not find a GVCF for some samples')
     #     sys.exit(1)
 
+    if validate_gvcfs:
+        from validate_inputs import PRIMARY_CONTIGS, validate_files
+
+        results = validate_files(gvcf_by_sample, expected_contigs=PRIMARY_CONTIGS)
+        for sample, result in results.items():
+            for warning in result['warnings']:
+                logger.warning(f'{sample}, GVCF {result["path"]}: {warning}')
+            if result['problems']:
+                logger.error(f'Skipping {sample}, invalid GVCF {result["path"]}: '
+                             f'{"; ".join(result["problems"])}')
+                del gvcf_by_sample[sample]
+
     if move_locally:
         gvcf_by_sample, picard_file_by_sname_by_key = \
             _move_locally(gvcf_by_sample, dataset_name, picard_file_by_sname_by_key)
@@ -292,6 +315,8 @@ def file_exists(path: str) -> bool:
         path = path.rstrip('/')  # ".mt/" -> ".mt"
         if any(path.endswith(f'.{suf}') for suf in ['mt', 'ht']):
             path = os.path.join(path, '_SUCCESS')
+        from google.cloud import storage
+
         gs = storage.Client()
         return gs.get_bucket(bucket).get_blob(path)
     return os.path.exists(path)
@@ -4,11 +4,9 @@ Generates JSON inputs for WARP WGS pipelines
 
 import json
 import os
-import subprocess
 from collections import defaultdict
 from os.path import basename
 import pandas as pd
-import progressbar
 
 
 # spreadsheet with 1kg metadata
@@ -277,54 +275,19 @@ rule make_sample_map:
         gs_data_bucket = GS_1GK_DATA_BUCKET,
         gvcf_bucket_ptrns = GVCF_1KG_BUCKET_PATTERNS,
     run:
+        from warp_batch import assemble_input_files, listing_requests, run_listings
         print(f'Finding inputs and generating WARP input files...')
-        df = pd.read_csv(input.ped, sep='\t')
-        
-        input_files_by_sample = defaultdict(list)
-        for (_, row), _ in zip(df.iterrows(), progressbar.progressbar(range(len(df)))):
-            sample = row['Individual.ID']
-
-            its = [it for it in INPUT_TYPES if it in ['exome_bam', 'wgs_bam', 'wgs_bam_highcov']]
-            for it in its:
-                if row[INPUT_TYPES_TO_FOLDER_NAME[it]]:
-                    print(f'Finding BAMs for {sample}')
-                    cmd = f'gsutil -u fewgenomes ls "{params.gs_data_bucket}/{sample}/' \
-                          f'{INPUT_TYPES_TO_FOLDER_NAME[it]}/{sample}.*.bam"'
-                    bam_fpaths = subprocess.check_output(cmd, shell=True).decode().split('\n')
-                    bam_fpath = bam_fpaths[0]
-                    input_files_by_sample[sample].append(bam_fpath)
-                if row['gatksv_cram'] and isinstance(row['gatksv_cram'], str):
-                    input_files_by_sample[sample].append(row['gatksv_cram'])
-
-            its = [it for it in INPUT_TYPES if it == 'wgs_fastq']
-            for it in its:
-                print(f'Finding fastqs for {sample}')
-                cmd = f'gsutil -u fewgenomes ls "{params.gs_data_bucket}/{sample}/' \
-                      f'sequence_read/*_*.filt.fastq.gz"'
-                fastq_fpaths = subprocess.check_output(cmd, shell=True).decode().split('\n')
-                r1_fpaths = sorted([fp for fp in fastq_fpaths if
-                                    fp.endswith('1.filt.fastq.gz')])
-                r2_fpaths = sorted([fp for fp in fastq_fpaths if
-                                    fp.endswith('2.filt.fastq.gz')])
-                fastq_pairs = list(zip(r1_fpaths, r2_fpaths))
-                input_files_by_sample[sample] = \
-                    ','.join(['|'.join(fp) for fp in fastq_pairs])
-
-            its = [it for it in INPUT_TYPES if it == 'gvcf']
-            for it in its:
-                if row[INPUT_TYPES_TO_FOLDER_NAME[it]]:
-                    print(f'Finding GVCFs for {sample}')
-                    for ptn in params.gvcf_bucket_ptrns:
-                        path = ptn.replace('*', sample)
-                        cmd = f'gsutil -u fewgenomes ls "{path}"'
-                        print(cmd)
-                        try:
-                            subprocess.check_output(cmd, shell=True).decode().split('\n')
-                        except subprocess.CalledProcessError:
-                            pass
-                        else:
-                            input_files_by_sample[sample] = path
-                            break
+        rows = pd.read_csv(input.ped, sep='\t').to_dict('records')
+        # list all samples at once, locally or in Batch jobs with executor=batch
+        listings = listing_requests(
+            rows, INPUT_TYPES, INPUT_TYPES_TO_FOLDER_NAME,
+            params.gs_data_bucket, params.gvcf_bucket_ptrns,
+        )
+        results = run_listings(listings, config)
+        input_files_by_sample = assemble_input_files(
+            rows, INPUT_TYPES, INPUT_TYPES_TO_FOLDER_NAME, results,
+            params.gs_data_bucket, params.gvcf_bucket_ptrns,
+        )
 
         with open(output.sample_map, 'w') as out:
             for sample, input_files in input_files_by_sample.items():
@@ -342,14 +305,34 @@ if COPY_LOCALLY_BUCKET:
             bucket = COPY_LOCALLY_BUCKET,
             dataset = DATASET,
         run:
-            with open(input.sample_map) as f,\
-                 open(output.sample_map, 'w') as out:
-                for line in f:
-                    sample, gvcf = line.strip().split()
-                    out_gvcf_name = f'{sample}.g.vcf.gz'
-                    target_path = f'{params.bucket}/gvcf/batch1/{out_gvcf_name}'
-                    shell(f'gsutil ls {target_path} || gsutil -u fewgenomes cp {gvcf} {target_path}')
-                    shell(f'gsutil ls {target_path}.tbi || gsutil -u fewgenomes cp {gvcf}.tbi {target_path}.tbi')
+            from validate_inputs import PRIMARY_CONTIGS, validate_files
+            from warp_batch import run_copies
+            with open(input.sample_map) as f:
+                gvcf_by_sample = dict(line.strip().split() for line in f)
+            # check all source GVCFs with ranged reads before copying any
+            results = validate_files(
+                gvcf_by_sample,
+                user_project='fewgenomes',
+                expected_contigs=PRIMARY_CONTIGS,
+            )
+            copies = []
+            target_by_sample = {}
+            for sample, gvcf in gvcf_by_sample.items():
+                if results[sample]['problems']:
+                    print(f'Skipping {sample}, invalid GVCF {gvcf}: '
+                          f'{"; ".join(results[sample]["problems"])}')
+                    continue
+                for warning in results[sample]['warnings']:
+                    print(f'Warning for {sample}, GVCF {gvcf}: {warning}')
+                out_gvcf_name = f'{sample}.g.vcf.gz'
+                target_path = f'{params.bucket}/gvcf/batch1/{out_gvcf_name}'
+                copies.append((sample, gvcf, target_path))
+                copies.append((sample, f'{gvcf}.tbi', f'{target_path}.tbi'))
+                target_by_sample[sample] = target_path
+            # skips targets that already exist, locally or in Batch jobs
+            run_copies(copies, config)
+            with open(output.sample_map, 'w') as out:
+                for sample, target_path in target_by_sample.items():
                     out.write('\t'.join([sample, target_path]) + '\n')
 
     sample_map = rules.copy_gvcf.output.sample_map
@@ -1,11 +1,20 @@
 """
 Copies HGDP CRAM and index files listed in a CSV file
 to the gs://cpg-fewgenomes-main bucket.
+
+Files are packed into jobs by total size, so each job pays the image pull and
+authentication once for many files. Files within a job are copied in parallel,
+and failed copies are retried for the failed files only.
 """
 
 import os
 import csv
+import shlex
+from collections import defaultdict
+from typing import Dict, List
+
 import hailtop.batch as hb
+from google.cloud import storage
 
 # OUTPUT gets propagated from the analysis-runner cli to the server
 output_bucket = os.getenv('OUTPUT')
@@ -15,18 +24,90 @@ assert output_bucket and output_bucket.startswith('gs://cpg-fewgenomes-main/')
 INPUT_FILELIST = './data/filtered65.csv'
 ANALYSIS_RUNNER_IMAGE = 'australia-southeast1-docker.pkg.dev/analysis-runner/images/driver:45c3f8125e300cd70bb790e32d96816f003a7af2-hail-0.2.64.devcb1c44c7b529'
 
+# limits on the files packed into a single copy job
+JOB_MAX_BYTES = 500 * 1024 ** 3
+JOB_MAX_FILES = 50
+COPY_ATTEMPTS = 3
+
+
+def get_sizes(paths: List[str]) -> Dict[str, int]:
+    """
+    Looks up object sizes by listing each source folder once,
+    rather than requesting each object's metadata separately
+    """
+    client = storage.Client()
+    wanted = set(paths)
+    sizes = {}
+    for folder in {os.path.dirname(path) for path in wanted}:
+        bucket_name, _, prefix = folder[len('gs://'):].partition('/')
+        for blob in client.list_blobs(bucket_name, prefix=prefix and f'{prefix}/'):
+            path = f'gs://{bucket_name}/{blob.name}'
+            if path in wanted:
+                sizes[path] = blob.size
+    return sizes
+
+
+def pack_by_size(sizes: Dict[str, int]) -> List[List[str]]:
+    """
+    First-fit decreasing packing of files into jobs, limited by
+    total bytes and number of files per job
+    """
+    jobs: List[List[str]] = []
+    job_bytes: List[int] = []
+    for path, size in sorted(sizes.items(), key=lambda item: -item[1]):
+        for i, job in enumerate(jobs):
+            if len(job) < JOB_MAX_FILES and job_bytes[i] + size <= JOB_MAX_BYTES:
+                job.append(path)
+                job_bytes[i] += size
+                break
+        else:
+            jobs.append([path])
+            job_bytes.append(size)
+    return jobs
+
+
+def copy_command(paths: List[str]) -> str:
+    """
+    Copies all files in parallel. The gsutil manifest records each file's
+    outcome, so a retry only copies the files which previously failed.
+    """
+    file_list = ' '.join(shlex.quote(path) for path in paths)
+    return f"""
+printf '%s\\n' {file_list} > files.txt
+copied=0
+for attempt in $(seq 1 {COPY_ATTEMPTS}); do
+  if gsutil -m cp -L manifest.csv -I {output_bucket} < files.txt; then
+    copied=1
+    break
+  fi
+  echo "Copy attempt $attempt failed, retrying failed files"
+done
+[ $copied = 1 ]
+"""
+
+
+with open(INPUT_FILELIST, newline='') as csvfile:
+    rows = list(csv.DictReader(csvfile))
+
+file_sizes = get_sizes([row['fname'] for row in rows])
+missing = [row['fname'] for row in rows if row['fname'] not in file_sizes]
+assert not missing, f'Files not found: {missing}'
+
+samples_by_path = defaultdict(set)
+for row in rows:
+    samples_by_path[row['fname']].add(row['sample_name'])
+
 service_backend = hb.ServiceBackend(
     billing_project=os.getenv('HAIL_BILLING_PROJECT'), bucket=os.getenv('HAIL_BUCKET')
 )
 b = hb.Batch(backend=service_backend, name='copy-crams')
 
 # Create Hail Batch jobs to copy CRAMs and indexes listed in CSV file to output bucket
-with open(INPUT_FILELIST, newline='') as csvfile:
-    reader = csv.DictReader(csvfile)
-    for row in reader:
-        j_copy = b.new_job(name=f'copy-{row["sample_name"]}-{row["ftype"]}')
-        (j_copy.image(ANALYSIS_RUNNER_IMAGE)
-               .command(f'gcloud -q auth activate-service-account --key-file=/gsa-key/key.json')
-               .command(f'gsutil cp {row["fname"]} {output_bucket}'))
+for job_paths in pack_by_size(file_sizes):
+    n_samples = len(set.union(*(samples_by_path[path] for path in job_paths)))
+    j_copy = b.new_job(name=f'copy-{len(job_paths)}-files-{n_samples}-samples')
+    (j_copy.image(ANALYSIS_RUNNER_IMAGE)
+           .command(f'gcloud -q auth activate-service-account --key-file=/gsa-key/key.json')
+           .command(copy_command(job_paths)))
 
 b.run()
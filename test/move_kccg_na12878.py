@@ -2,6 +2,9 @@
 
 import os
 import subprocess
+import sys
+
+from verify_integrity import print_results, verify
 
 output = os.getenv('OUTPUT')
 assert output and output.startswith('gs://cpg-fewgenomes-test/')
@@ -9,3 +12,6 @@ assert output and output.startswith('gs://cpg-fewgenomes-test/')
 subprocess.run(
     ['gsutil', 'mv', 'gs://cpg-fewgenomes-upload/kccg/*', output]
 )
+
+# Checks any objects with .md5sum sidecars against their stored checksums
+sys.exit(1 if print_results(verify([output])) else 0)
@@ -2,6 +2,9 @@
 
 import os
 import subprocess
+import sys
+
+from verify_integrity import print_results, verify
 
 output = os.getenv('OUTPUT')
 assert output and output.startswith('gs://cpg-fewgenomes-test/')
@@ -10,8 +13,12 @@ subprocess.run(
     ['gsutil', 'mv', 'gs://cpg-fewgenomes-upload/cas-simons/*', output]
 )
 
-subprocess.run(['cat', f'{output}/NA12878-HIGH.bam.md5sum'])
-
-subprocess.run(
-    f'gsutil cat {output}/NA12878-HIGH.bam | md5sum', shell=True
-)
+# Compares stored object checksums against the .md5sum sidecars,
+# rather than streaming the BAMs through md5sum
+results = verify([output])
+n_failed = print_results(results)
+bam_path = f'{output.rstrip("/")}/NA12878-HIGH.bam'
+if bam_path not in [result['path'] for result in results]:
+    print(f'{bam_path} was not checked, its .md5sum sidecar may be missing')
+    n_failed += 1
+sys.exit(1 if n_failed else 0)
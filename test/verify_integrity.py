@@ -0,0 +1,202 @@
+"""
+Verifies copied objects against their expected MD5 checksums, without
+streaming whole files through a single machine.
+
+Expected checksums come from `.md5sum` sidecar files next to each object,
+and/or from a manifest in `md5sum` format (`<md5>  <gs://path>` per line).
+They are compared with the MD5 stored in each object's metadata. Only objects
+without a stored MD5 (e.g. composite uploads) are hashed, using parallel
+ranged reads.
+
+Run as follows, to check all the dataset buckets in one go. Reading the main
+and upload buckets needs full access:
+
+analysis-runner \
+    --dataset fewgenomes \
+    --access-level full \
+    --description "verify integrity" \
+    --output verify_integrity \
+    python3 verify_integrity.py
+
+With test access, pass the test bucket explicitly:
+
+analysis-runner \
+    --dataset fewgenomes \
+    --access-level test \
+    --description "verify integrity" \
+    --output verify_integrity \
+    python3 verify_integrity.py gs://cpg-fewgenomes-test
+"""
+
+import base64
+import hashlib
+import sys
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+import click
+from google.cloud import storage
+
+DEFAULT_PREFIXES = [
+    'gs://cpg-fewgenomes-main',
+    'gs://cpg-fewgenomes-test',
+    'gs://cpg-fewgenomes-upload',
+]
+SIDECAR_SUFFIX = '.md5sum'
+CHUNK_SIZE = 64 * 1024 * 1024
+WORKERS = 16
+
+
+def split_path(path: str):
+    """Splits gs://bucket/name into the bucket and object names"""
+    bucket, _, name = path[len('gs://'):].partition('/')
+    return bucket, name
+
+
+def normalise_prefix(prefix: str) -> str:
+    """Ends the prefix with a /, so gs://bucket/foo doesn't match gs://bucket/foo-bar"""
+    return prefix.rstrip('/') + '/'
+
+
+def list_objects(client: storage.Client, prefix: str) -> Dict[str, storage.Blob]:
+    """Lists all objects under the prefix, with their metadata"""
+    bucket, name = split_path(normalise_prefix(prefix))
+    return {
+        f'gs://{bucket}/{blob.name}': blob
+        for blob in client.list_blobs(bucket, prefix=name)
+    }
+
+
+def parse_md5sum(text: str) -> Dict[str, str]:
+    """Parses `<md5>  <path>` lines into a lookup of path to md5"""
+    checksums = {}
+    for line in text.splitlines():
+        fields = line.split()
+        if len(fields) >= 2:
+            checksums[fields[1].lstrip('*')] = fields[0].lower()
+    return checksums
+
+
+def read_sidecars(blobs: Dict[str, storage.Blob]) -> Dict[str, str]:
+    """
+    Reads all `.md5sum` sidecars concurrently. The first checksum in each
+    sidecar applies to the object it sits next to, whatever name it records.
+    """
+    sidecars = {
+        path[: -len(SIDECAR_SUFFIX)]: blob
+        for path, blob in blobs.items()
+        if path.endswith(SIDECAR_SUFFIX)
+    }
+    with ThreadPoolExecutor(WORKERS) as executor:
+        texts = executor.map(
+            lambda blob: blob.download_as_bytes().decode(), sidecars.values()
+        )
+        expected = {}
+        for path, text in zip(sidecars, texts):
+            fields = text.split()
+            if fields:
+                expected[path] = fields[0].lower()
+    return expected
+
+
+def stored_md5(blob: storage.Blob) -> Optional[str]:
+    """MD5 from the object metadata as a hex string, if the object has one"""
+    if not blob.md5_hash:
+        return None
+    return base64.b64decode(blob.md5_hash).hex()
+
+
+def hash_by_ranges(blob: storage.Blob) -> str:
+    """
+    Computes the MD5 of an object by fetching ranges in parallel. The digest
+    is updated in order, with a bounded number of ranges in flight.
+    """
+    md5 = hashlib.md5()
+    with ThreadPoolExecutor(WORKERS) as executor:
+        in_flight: deque = deque()
+        for start in range(0, blob.size, CHUNK_SIZE):
+            end = min(start + CHUNK_SIZE, blob.size) - 1
+            in_flight.append(
+                executor.submit(blob.download_as_bytes, start=start, end=end)
+            )
+            if len(in_flight) >= WORKERS * 2:
+                md5.update(in_flight.popleft().result())
+        while in_flight:
+            md5.update(in_flight.popleft().result())
+    return md5.hexdigest()
+
+
+def verify(prefixes: List[str], manifest_text: str = '') -> List[dict]:
+    """
+    Checks every object with an expected checksum under the given prefixes
+    :return: list of results, one per checked object
+    """
+    prefixes = [normalise_prefix(prefix) for prefix in prefixes]
+    client = storage.Client()
+    blobs: Dict[str, storage.Blob] = {}
+    for prefix in prefixes:
+        blobs.update(list_objects(client, prefix))
+
+    expected = parse_md5sum(manifest_text)
+    expected.update(read_sidecars(blobs))
+
+    results = []
+    for path, md5 in sorted(expected.items()):
+        blob = blobs.get(path)
+        if blob is None:
+            if any(path.startswith(prefix) for prefix in prefixes):
+                results.append(dict(path=path, status='missing', method=None))
+            continue
+        actual = stored_md5(blob)
+        method = 'metadata'
+        if actual is None:
+            print(f'No stored MD5 for {path}, hashing by ranged reads')
+            actual = hash_by_ranges(blob)
+            method = 'ranged-read'
+        status = 'ok' if actual == md5 else 'mismatch'
+        results.append(dict(path=path, status=status, method=method))
+    return results
+
+
+def print_results(results: List[dict]) -> int:
+    """
+    Prints one line per checked object, returning the number of failures.
+    Checking no objects at all is a failure, e.g. when the sidecars are missing.
+    """
+    for result in results:
+        print(f'{result["status"]}\t{result["method"]}\t{result["path"]}')
+    if not results:
+        print('No objects with expected checksums were found, nothing was checked')
+        return 1
+    failed = [result for result in results if result['status'] != 'ok']
+    print(f'Checked {len(results)} objects, {len(failed)} failed')
+    return len(failed)
+
+
+@click.command()
+@click.argument('prefixes', nargs=-1)
+@click.option(
+    '--manifest',
+    'manifest_path',
+    help='Manifest of expected checksums, in md5sum format, local or on GCS.',
+)
+def main(prefixes, manifest_path):
+    """
+    Verify objects under PREFIXES (default: all fewgenomes buckets, which needs
+    full access)
+    """
+    prefixes = list(prefixes) or DEFAULT_PREFIXES
+    manifest_text = ''
+    if manifest_path and manifest_path.startswith('gs://'):
+        bucket, name = split_path(manifest_path)
+        manifest_text = storage.Client().bucket(bucket).blob(name).download_as_text()
+    elif manifest_path:
+        with open(manifest_path) as f:
+            manifest_text = f.read()
+
+    sys.exit(1 if print_results(verify(prefixes, manifest_text)) else 0)
+
+
+if __name__ == '__main__':
+    main()  # pylint: disable=E1120
@@ -0,0 +1,326 @@
+#!/usr/bin/env python
+
+"""
+Validates GVCF and CRAM inputs using small ranged reads, without downloading them.
+
+For each GVCF, checks the BGZF header and EOF block, the sample name and contigs
+in the VCF header, and the contigs covered by the matching tabix index.
+For each CRAM, checks the file definition, the EOF container and the CRAI index.
+
+An index older than its data file is only a warning: parallel uploads, e.g. with
+`gsutil -m cp` or Cromwell delocalisation, don't keep the order of the files.
+"""
+
+import csv
+import gzip
+import os
+import struct
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING, Dict, List, Optional, Tuple
+
+import click
+
+if TYPE_CHECKING:
+    from google.cloud import storage
+
+
+BGZF_MAGIC = b'\x1f\x8b\x08\x04'
+BGZF_EOF = bytes.fromhex(
+    '1f8b08040000000000ff0600424302001b0003000000000000000000'
+)
+CRAM3_EOF = bytes.fromhex(
+    '0f000000ffffffff0fe0454f4600000000010005bdd94f0001000606010001000100ee63014b'
+)
+TABIX_MAGIC = b'TBI\x01'
+PRIMARY_CONTIGS = [f'chr{c}' for c in list(range(1, 23)) + ['X', 'Y']]
+
+# VCF headers are read in growing chunks, up to this size
+HEADER_CHUNK_SIZE = 256 * 1024
+HEADER_MAX_SIZE = 16 * 1024 * 1024
+
+
+class RangeReader:
+    """
+    Reads byte ranges and sizes of local files or GCS objects
+    """
+
+    def __init__(self, user_project: Optional[str] = None):
+        self.user_project = user_project
+        self._client = None
+
+    def _bucket(self, path: str) -> Tuple['storage.Bucket', str]:
+        """The bucket and object name of a GCS path"""
+        if self._client is None:
+            # only needed for GCS paths, and slow to import
+            from google.cloud import storage
+
+            self._client = storage.Client()
+        bucket_name, name = path[len('gs://'):].split('/', maxsplit=1)
+        return self._client.bucket(bucket_name, user_project=self.user_project), name
+
+    def stat(self, path: str) -> Optional[Tuple[int, float]]:
+        """Size and modification time, or None if the file doesn't exist"""
+        if path.startswith('gs://'):
+            bucket, name = self._bucket(path)
+            blob = bucket.get_blob(name)
+            if blob is None:
+                return None
+            return blob.size, blob.updated.timestamp()
+        if not os.path.exists(path):
+            return None
+        return os.path.getsize(path), os.path.getmtime(path)
+
+    def read(self, path: str, start: int, end: int) -> bytes:
+        """Reads bytes [start, end) of the file"""
+        if path.startswith('gs://'):
+            # blob() doesn't fetch the metadata, so each read is a single request
+            bucket, name = self._bucket(path)
+            return bucket.blob(name).download_as_bytes(start=start, end=end - 1)
+        with open(path, 'rb') as f:
+            f.seek(start)
+            return f.read(end - start)
+
+
+def split_bgzf_blocks(data: bytes) -> Tuple[List[bytes], bool]:
+    """
+    Splits data into complete BGZF blocks.
+    :return: the complete blocks, and whether the data is valid BGZF
+    """
+    blocks = []
+    offset = 0
+    while offset + 18 <= len(data):
+        if data[offset:offset + 4] != BGZF_MAGIC:
+            return blocks, False
+        xlen = struct.unpack_from('<H', data, offset + 10)[0]
+        block_size = None
+        extra_offset = offset + 12
+        while extra_offset < offset + 12 + xlen:
+            si1, si2, slen = struct.unpack_from('<BBH', data, extra_offset)
+            if (si1, si2) == (66, 67):
+                block_size = struct.unpack_from('<H', data, extra_offset + 4)[0] + 1
+            extra_offset += 4 + slen
+        if block_size is None:
+            return blocks, False
+        if offset + block_size > len(data):
+            break
+        blocks.append(data[offset:offset + block_size])
+        offset += block_size
+    return blocks, True
+
+
+def read_vcf_header(
+    reader: RangeReader, path: str, size: int
+) -> Tuple[List[str], bool]:
+    """
+    Reads the VCF header lines from the start of a BGZF-compressed VCF.
+    :return: header lines, and whether the file starts with valid BGZF
+    """
+    read_size = HEADER_CHUNK_SIZE
+    while True:
+        data = reader.read(path, 0, min(read_size, size))
+        blocks, valid = split_bgzf_blocks(data)
+        if not valid:
+            return [], False
+        text = gzip.decompress(b''.join(blocks)).decode(errors='replace')
+        lines = text.split('\n')
+        for i, line in enumerate(lines):
+            if line.startswith('#CHROM'):
+                return lines[:i + 1], True
+            if line and not line.startswith('#'):
+                return lines[:i], True
+        if read_size >= min(size, HEADER_MAX_SIZE):
+            return lines, True
+        read_size *= 4
+
+
+def parse_tabix_contigs(data: bytes) -> Optional[List[str]]:
+    """Contig names from a tabix index, or None if it isn't one"""
+    try:
+        content = gzip.decompress(data)
+    except OSError:
+        return None
+    if content[:4] != TABIX_MAGIC:
+        return None
+    n_ref = struct.unpack_from('<i', content, 4)[0]
+    l_nm = struct.unpack_from('<i', content, 32)[0]
+    names = content[36:36 + l_nm].split(b'\x00')
+    return [name.decode() for name in names if name][:n_ref]
+
+
+def validate_gvcf(
+    reader: RangeReader,
+    path: str,
+    sample: Optional[str] = None,
+    expected_contigs: Optional[List[str]] = None,
+) -> dict:
+    """
+    Validates a single GVCF and its tabix index
+    """
+    result: dict = dict(
+        path=path, sample=None, contigs=0, problems=[], warnings=[]
+    )
+    problems = result['problems']
+    stat = reader.stat(path)
+    if stat is None:
+        problems.append('missing')
+        return result
+    size, mtime = stat
+
+    header, valid = read_vcf_header(reader, path, size)
+    if not valid:
+        problems.append('not BGZF-compressed')
+        return result
+    if reader.read(path, max(0, size - len(BGZF_EOF)), size) != BGZF_EOF:
+        problems.append('truncated: no BGZF EOF block')
+
+    chrom_line = [line for line in header if line.startswith('#CHROM')]
+    if not chrom_line:
+        problems.append('no #CHROM header line')
+    else:
+        samples = chrom_line[0].split('\t')[9:]
+        result['sample'] = ','.join(samples)
+        if len(samples) != 1:
+            problems.append(f'expected 1 sample, found {len(samples)}')
+        elif sample and samples[0] != sample:
+            problems.append(f'sample name {samples[0]} does not match {sample}')
+
+    index_stat = reader.stat(path + '.tbi')
+    if index_stat is None:
+        problems.append('missing .tbi index')
+        return result
+    index_size, index_mtime = index_stat
+    if index_mtime < mtime:
+        result['warnings'].append('.tbi index is older than the GVCF')
+    index_contigs = parse_tabix_contigs(reader.read(path + '.tbi', 0, index_size))
+    if index_contigs is None:
+        problems.append('invalid .tbi index')
+        return result
+    result['contigs'] = len(index_contigs)
+    missing = [c for c in (expected_contigs or []) if c not in index_contigs]
+    if missing:
+        problems.append(f'no records for contigs: {",".join(missing)}')
+    return result
+
+
+def validate_cram(reader: RangeReader, path: str) -> dict:
+    """
+    Validates a single CRAM and its CRAI index
+    """
+    result: dict = dict(
+        path=path, sample=None, contigs=0, problems=[], warnings=[]
+    )
+    problems = result['problems']
+    stat = reader.stat(path)
+    if stat is None:
+        problems.append('missing')
+        return result
+    size, mtime = stat
+
+    file_definition = reader.read(path, 0, 6)
+    if file_definition[:4] != b'CRAM':
+        problems.append('not a CRAM file')
+        return result
+    if file_definition[4] != 3:
+        problems.append(f'unsupported CRAM version {file_definition[4]}')
+    elif reader.read(path, max(0, size - len(CRAM3_EOF)), size) != CRAM3_EOF:
+        problems.append('truncated: no CRAM EOF container')
+
+    index_stat = reader.stat(path + '.crai')
+    if index_stat is None:
+        problems.append('missing .crai index')
+        return result
+    index_size, index_mtime = index_stat
+    if index_mtime < mtime:
+        result['warnings'].append('.crai index is older than the CRAM')
+    try:
+        index = gzip.decompress(reader.read(path + '.crai', 0, index_size)).decode()
+    except OSError:
+        problems.append('invalid .crai index')
+        return result
+    ref_ids = {line.split('\t')[0] for line in index.splitlines() if line}
+    result['contigs'] = len(ref_ids - {'-1'})
+    if not result['contigs']:
+        problems.append('no mapped reads in the .crai index')
+    return result
+
+
+def validate_files(
+    path_by_sample: Dict[str, str],
+    user_project: Optional[str] = None,
+    expected_contigs: Optional[List[str]] = None,
+    threads: int = 16,
+) -> Dict[str, dict]:
+    """
+    Validates many GVCFs or CRAMs concurrently
+    :param path_by_sample: sample name -> file path
+    :return: sample name -> validation result, with lists of problems (the file
+        is unusable) and warnings
+    """
+    reader = RangeReader(user_project)
+
+    def _validate(item):
+        sample, path = item
+        if path.endswith('.cram'):
+            return validate_cram(reader, path)
+        return validate_gvcf(reader, path, sample, expected_contigs)
+
+    with ThreadPoolExecutor(threads) as executor:
+        results = executor.map(_validate, path_by_sample.items())
+        return dict(zip(path_by_sample, results))
+
+
+def read_sample_map(path: str) -> Dict[str, str]:
+    """
+    Reads a combiner sample map CSV (with `sample` and `gvcf` columns),
+    or a headerless sample<TAB>path TSV
+    """
+    with open(path) as f:
+        if path.endswith('.csv'):
+            return {row['sample']: row['gvcf'] for row in csv.DictReader(f)}
+        return dict(line.strip().split('\t')[:2] for line in f if line.strip())
+
+
+@click.command()
+@click.argument('sample_map')
+@click.option(
+    '--user-project',
+    'user_project',
+    help='Project to bill for requester-pays buckets, e.g. "fewgenomes".'
+)
+@click.option(
+    '--contigs',
+    'contigs',
+    default=','.join(PRIMARY_CONTIGS),
+    help='Comma-separated contigs every GVCF must cover. Default: chr1-22, X, Y.'
+)
+@click.option(
+    '--threads',
+    'threads',
+    default=16,
+    type=click.INT,
+    help='Number of files to validate concurrently.'
+)
+def main(sample_map: str, user_project: str, contigs: str, threads: int):
+    """
+    Validate all GVCFs or CRAMs listed in SAMPLE_MAP
+    """
+    results = validate_files(
+        read_sample_map(sample_map),
+        user_project=user_project,
+        expected_contigs=[c for c in contigs.split(',') if c],
+        threads=threads,
+    )
+    n_failed = 0
+    for sample, result in results.items():
+        status = '; '.join(result['problems']) or 'ok'
+        if result['warnings']:
+            status += f' (warnings: {"; ".join(result["warnings"])})'
+        print(f'{sample}\t{result["contigs"]} contigs\t{status}\t{result["path"]}')
+        n_failed += bool(result['problems'])
+    print(f'Validated {len(results)} files, {n_failed} failed')
+    sys.exit(1 if n_failed else 0)
+
+
+if __name__ == '__main__':
+    main()  # pylint: disable=E1120
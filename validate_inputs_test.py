@@ -0,0 +1,140 @@
+import gzip
+import os
+import shutil
+import struct
+
+import pytest
+
+from validate_inputs import (
+    BGZF_EOF,
+    CRAM3_EOF,
+    TABIX_MAGIC,
+    RangeReader,
+    parse_tabix_contigs,
+    read_vcf_header,
+    split_bgzf_blocks,
+    validate_cram,
+    validate_gvcf,
+)
+
+
+"""
+tests for the BGZF, tabix and CRAI parsing, on local copies of the minimised
+1kg VCF from datasets/acute-care, which has 4 samples and a single variant on
+contig 2
+"""
+
+
+CURDIR = os.path.dirname(os.path.abspath(__file__))
+VCF_PATH = os.path.join(CURDIR, "datasets", "acute-care", "1kg.vcf.bgz")
+SAMPLES = ["HG00607", "HG00619", "HG00623", "HG00657"]
+
+
+def make_tabix(contigs: list) -> bytes:
+    """
+    a tabix index in VCF format, with the contig names and no bins
+    """
+    names = b"".join(contig.encode() + b"\x00" for contig in contigs)
+    content = TABIX_MAGIC + struct.pack(
+        "<iiiiiiii", len(contigs), 2, 1, 2, 0, ord("#"), 0, len(names)
+    )
+    content += names + struct.pack("<ii", 0, 0) * len(contigs)
+    return gzip.compress(content)
+
+
+@pytest.fixture()
+def gvcf(tmp_path):
+    path = str(tmp_path / "sample.g.vcf.gz")
+    shutil.copy(VCF_PATH, path)
+    with open(path + ".tbi", "wb") as f:
+        f.write(make_tabix(["2"]))
+    yield path
+
+
+@pytest.fixture()
+def cram(tmp_path):
+    path = str(tmp_path / "sample.cram")
+    with open(path, "wb") as f:
+        f.write(b"CRAM\x03\x00" + b"\x00" * 20 + CRAM3_EOF)
+    with open(path + ".crai", "wb") as f:
+        f.write(gzip.compress(b"0\t1\t100\t26\t10\t10\n1\t1\t100\t36\t10\t10\n"))
+    yield path
+
+
+def test_split_bgzf_blocks():
+    with open(VCF_PATH, "rb") as f:
+        data = f.read()
+    blocks, valid = split_bgzf_blocks(data)
+    assert valid
+    assert blocks[-1] == BGZF_EOF
+    assert b"".join(blocks) == data
+    # a block cut short is left out, but the data is still valid
+    blocks, valid = split_bgzf_blocks(data[:-10])
+    assert valid and blocks[-1] != BGZF_EOF
+    assert split_bgzf_blocks(gzip.compress(b"plain gzip")) == ([], False)
+
+
+def test_read_vcf_header():
+    header, valid = read_vcf_header(RangeReader(), VCF_PATH, os.path.getsize(VCF_PATH))
+    assert valid
+    assert header[0].startswith("##fileformat=VCF")
+    assert header[-1].split("\t")[9:] == SAMPLES
+
+
+def test_parse_tabix_contigs():
+    assert parse_tabix_contigs(make_tabix(["chr1", "chr2", "chrX"])) == [
+        "chr1",
+        "chr2",
+        "chrX",
+    ]
+    assert parse_tabix_contigs(gzip.compress(b"CSI\x01")) is None
+    assert parse_tabix_contigs(b"not gzipped") is None
+
+
+def test_validate_gvcf(gvcf):
+    result = validate_gvcf(RangeReader(), gvcf, expected_contigs=["2", "3"])
+    assert result["sample"] == ",".join(SAMPLES)
+    assert result["contigs"] == 1
+    assert result["problems"] == [
+        "expected 1 sample, found 4",
+        "no records for contigs: 3",
+    ]
+
+
+def test_validate_gvcf_truncated(gvcf):
+    with open(gvcf, "rb") as f:
+        data = f.read()
+    with open(gvcf, "wb") as f:
+        f.write(data[: -len(BGZF_EOF)])
+    result = validate_gvcf(RangeReader(), gvcf)
+    assert "truncated: no BGZF EOF block" in result["problems"]
+
+
+def test_validate_gvcf_older_index(gvcf):
+    """
+    upload order isn't kept by parallel copies, so this is only a warning
+    """
+    mtime = os.path.getmtime(gvcf)
+    os.utime(gvcf + ".tbi", (mtime - 60, mtime - 60))
+    result = validate_gvcf(RangeReader(), gvcf, expected_contigs=["2"])
+    assert result["warnings"] == [".tbi index is older than the GVCF"]
+    assert result["problems"] == ["expected 1 sample, found 4"]
+
+
+def test_validate_gvcf_missing_index(gvcf):
+    os.remove(gvcf + ".tbi")
+    result = validate_gvcf(RangeReader(), gvcf)
+    assert "missing .tbi index" in result["problems"]
+
+
+def test_validate_cram(cram):
+    result = validate_cram(RangeReader(), cram)
+    assert result["problems"] == []
+    assert result["contigs"] == 2
+
+
+def test_validate_cram_unmapped_only(cram):
+    with open(cram + ".crai", "wb") as f:
+        f.write(gzip.compress(b"-1\t0\t0\t26\t10\t10\n"))
+    result = validate_cram(RangeReader(), cram)
+    assert result["problems"] == ["no mapped reads in the .crai index"]
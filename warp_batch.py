@@ -0,0 +1,301 @@
+"""
+Per-sample input resolution and copying for prep_warp_inputs.smk, run either
+locally or as Hail Batch jobs next to the data.
+
+The workflow builds a list of listings to run (sample, kind, path pattern),
+and of copies. With `executor=batch`, both are sharded into jobs by groups of
+samples; listing jobs only return the raw listing output, which is parsed and
+assembled into the sample map locally, exactly as in the local mode.
+
+Config keys, passed with `snakemake --config`:
+- executor: `local` (default) or `batch`
+- batch_backend: `service` (default) or `local`. The local backend runs jobs
+  in Docker, so local paths are only visible with batch_local_mount
+- batch_shard_size: number of samples per job, default 100
+- batch_billing_project, batch_bucket: for the service backend, default to
+  $HAIL_BILLING_PROJECT and $HAIL_BUCKET
+- batch_image: image with gsutil, default google/cloud-sdk:slim
+- batch_local_mount: folder to mount at the same path into local backend jobs
+- user_project: project billed for requester-pays buckets, default fewgenomes
+"""
+
+import os
+import subprocess
+import uuid
+from os.path import abspath, dirname, join
+from shlex import quote
+from typing import Dict, List, Tuple
+
+DEFAULT_SHARD_SIZE = 100
+DEFAULT_IMAGE = 'google/cloud-sdk:slim'
+DEFAULT_USER_PROJECT = 'fewgenomes'
+BAM_INPUT_TYPES = ['exome_bam', 'wgs_bam', 'wgs_bam_highcov']
+
+# sample, kind (the input type), and the path pattern to list
+Listing = Tuple[str, str, str]
+
+
+def bam_pattern(gs_data_bucket: str, sample: str, folder: str) -> str:
+    return f'{gs_data_bucket}/{sample}/{folder}/{sample}.*.bam'
+
+
+def fastq_pattern(gs_data_bucket: str, sample: str) -> str:
+    return f'{gs_data_bucket}/{sample}/sequence_read/*_*.filt.fastq.gz'
+
+
+def listing_requests(
+    rows: List[dict],
+    input_types: List[str],
+    folder_by_input_type: Dict[str, str],
+    gs_data_bucket: str,
+    gvcf_patterns: List[str],
+) -> List[Listing]:
+    """
+    All listings needed to find the inputs of the samples in the PED rows
+    """
+    listings = []
+    for row in rows:
+        sample = row['Individual.ID']
+        for it in input_types:
+            if it in BAM_INPUT_TYPES and row[folder_by_input_type[it]]:
+                pattern = bam_pattern(gs_data_bucket, sample, folder_by_input_type[it])
+                listings.append((sample, it, pattern))
+            elif it == 'wgs_fastq':
+                listings.append((sample, it, fastq_pattern(gs_data_bucket, sample)))
+            elif it == 'gvcf' and row[folder_by_input_type[it]]:
+                for pattern in gvcf_patterns:
+                    listings.append((sample, it, pattern.replace('*', sample)))
+    return listings
+
+
+# the only errors which mean a listing is empty; any other error fails the listing
+NO_MATCH_ERRORS = [
+    'One or more URLs matched no objects',  # gsutil
+    'No such file or directory',  # ls
+]
+
+
+def list_command(pattern: str, user_project: str) -> str:
+    if pattern.startswith('gs://'):
+        return f'gsutil -u {user_project} ls {quote(pattern)}'
+    # unquoted, so the shell expands the wildcards
+    return f'ls -d {pattern}'
+
+
+def listing_script(listings: List[Listing], user_project: str) -> str:
+    """
+    Shell script printing each listing's output after a `#`-prefixed header.
+    A pattern without matches just has no output lines. Any other error, e.g.
+    with authentication or billing, stops the script with a non-zero status.
+    """
+    no_match = ' -e '.join(quote(error) for error in NO_MATCH_ERRORS)
+    lines = ['err=$(mktemp)']
+    for sample, kind, pattern in listings:
+        lines.append(
+            f"printf '#\\t%s\\t%s\\t%s\\n' "
+            f'{quote(sample)} {quote(kind)} {quote(pattern)}'
+        )
+        lines.append(
+            f'{list_command(pattern, user_project)} 2>"$err" || '
+            f'grep -q -e {no_match} "$err" || {{ cat "$err" >&2; exit 1; }}'
+        )
+    return '\n'.join(lines)
+
+
+def parse_listing_output(text: str) -> Dict[Listing, List[str]]:
+    results: Dict[Listing, List[str]] = {}
+    current = None
+    for line in text.splitlines():
+        if line.startswith('#\t'):
+            _, sample, kind, pattern = line.split('\t', 3)
+            current = (sample, kind, pattern)
+            results[current] = []
+        elif line.strip() and current:
+            results[current].append(line.strip())
+    return results
+
+
+def assemble_input_files(
+    rows: List[dict],
+    input_types: List[str],
+    folder_by_input_type: Dict[str, str],
+    results: Dict[Listing, List[str]],
+    gs_data_bucket: str,
+    gvcf_patterns: List[str],
+) -> Dict[str, str]:
+    """
+    Picks the input files of each sample from the listing results
+    :return: sample -> comma-separated input files
+    """
+    input_files_by_sample = {}
+    for row in rows:
+        sample = row['Individual.ID']
+        files = []
+        for it in [it for it in input_types if it in BAM_INPUT_TYPES]:
+            if row[folder_by_input_type[it]]:
+                pattern = bam_pattern(gs_data_bucket, sample, folder_by_input_type[it])
+                bam_fpaths = results.get((sample, it, pattern))
+                if not bam_fpaths:
+                    raise ValueError(f'No BAM found for {sample} at {pattern}')
+                files.append(bam_fpaths[0])
+            if isinstance(row.get('gatksv_cram'), str) and row['gatksv_cram']:
+                files.append(row['gatksv_cram'])
+
+        if 'wgs_fastq' in input_types:
+            fastq_fpaths = results.get(
+                (sample, 'wgs_fastq', fastq_pattern(gs_data_bucket, sample)), []
+            )
+            r1_fpaths = sorted(f for f in fastq_fpaths if f.endswith('1.filt.fastq.gz'))
+            r2_fpaths = sorted(f for f in fastq_fpaths if f.endswith('2.filt.fastq.gz'))
+            if not r1_fpaths or not r2_fpaths:
+                raise ValueError(f'No fastq pairs found for {sample}')
+            files = [','.join('|'.join(pair) for pair in zip(r1_fpaths, r2_fpaths))]
+
+        if 'gvcf' in input_types and row[folder_by_input_type['gvcf']]:
+            for pattern in gvcf_patterns:
+                path = pattern.replace('*', sample)
+                if results.get((sample, 'gvcf', path)):
+                    files = [path]
+                    break
+
+        if files:
+            input_files_by_sample[sample] = ','.join(files)
+    return input_files_by_sample
+
+
+def copy_command(src: str, dst: str, user_project: str) -> str:
+    """
+    Copies a file, unless the target already exists
+    """
+    if dst.startswith('gs://'):
+        return (
+            f'gsutil ls {quote(dst)} || '
+            f'gsutil -u {user_project} cp {quote(src)} {quote(dst)}'
+        )
+    return (
+        f'[ -e {quote(dst)} ] || '
+        f'(mkdir -p {quote(dirname(dst))} && cp {quote(src)} {quote(dst)})'
+    )
+
+
+def shard_by_sample(items: List[tuple], shard_size: int) -> List[List[tuple]]:
+    """
+    Groups items, keyed by sample in their first field, into shards of up to
+    shard_size samples, keeping all items of a sample together
+    """
+    items_by_sample: Dict[str, List[tuple]] = {}
+    for item in items:
+        items_by_sample.setdefault(item[0], []).append(item)
+    samples = list(items_by_sample)
+    shards = []
+    for i in range(0, len(samples), shard_size):
+        shard_samples = samples[i:i + shard_size]
+        shards.append([item for s in shard_samples for item in items_by_sample[s]])
+    return shards
+
+
+def read_text(path: str) -> str:
+    if path.startswith('gs://'):
+        return subprocess.check_output(['gsutil', 'cat', path]).decode()
+    with open(path) as f:
+        return f.read()
+
+
+def _shard_size(config: dict) -> int:
+    return int(config.get('batch_shard_size', DEFAULT_SHARD_SIZE))
+
+
+def _new_batch(name: str, config: dict):
+    """
+    Creates a batch on the configured backend
+    :return: the batch, and a folder for job outputs
+    """
+    import hailtop.batch as hb
+
+    run_id = f'{name}-{uuid.uuid4().hex[:8]}'
+    if config.get('batch_backend', 'service') == 'local':
+        mount = config.get('batch_local_mount')
+        mount_flags = f'-v {abspath(mount)}:{abspath(mount)}' if mount else None
+        backend = hb.LocalBackend(extra_docker_run_flags=mount_flags)
+        out_dir = abspath(join('work', 'batch', run_id))
+    else:
+        bucket = config.get('batch_bucket') or os.getenv('HAIL_BUCKET')
+        backend = hb.ServiceBackend(
+            billing_project=config.get('batch_billing_project')
+            or os.getenv('HAIL_BILLING_PROJECT'),
+            bucket=bucket,
+        )
+        out_dir = f'gs://{bucket}/prep-warp-inputs/{run_id}'
+    return hb.Batch(name=name, backend=backend), out_dir
+
+
+def _new_job(batch, config: dict, name: str):
+    job = batch.new_job(name=name)
+    job.image(config.get('batch_image', DEFAULT_IMAGE))
+    if config.get('batch_backend', 'service') != 'local':
+        job.command(
+            'gcloud -q auth activate-service-account --key-file=/gsa-key/key.json'
+        )
+    return job
+
+
+def _run_batch(batch):
+    result = batch.run()
+    # the service backend returns the submitted batch, the local one raises on failure
+    if result is not None and result.status()['state'] != 'success':
+        raise RuntimeError(f'Batch {batch.name} did not succeed: {result.status()}')
+
+
+def run_listings(listings: List[Listing], config: dict) -> Dict[Listing, List[str]]:
+    """
+    Runs all listings, locally or in Batch jobs depending on config['executor']
+    """
+    user_project = config.get('user_project', DEFAULT_USER_PROJECT)
+    if config.get('executor', 'local') != 'batch':
+        # through stdin, as the script outgrows the limit on a single argument
+        output = subprocess.run(
+            ['bash'],
+            input=listing_script(listings, user_project).encode(),
+            check=True,
+            stdout=subprocess.PIPE,
+        ).stdout.decode()
+        return parse_listing_output(output)
+
+    batch, out_dir = _new_batch('prep-warp-inputs-list', config)
+    shards = shard_by_sample(listings, _shard_size(config))
+    out_paths = []
+    for i, shard in enumerate(shards):
+        n_samples = len({sample for sample, _, _ in shard})
+        job = _new_job(batch, config, f'list-{i}-{n_samples}-samples')
+        job.command(f'{{\n{listing_script(shard, user_project)}\n}} > {job.ofile}')
+        out_paths.append(f'{out_dir}/list-{i}.tsv')
+        batch.write_output(job.ofile, out_paths[-1])
+    print(f'Listing inputs of {len(listings)} patterns in {len(shards)} jobs')
+    _run_batch(batch)
+
+    results = {}
+    for path in out_paths:
+        results.update(parse_listing_output(read_text(path)))
+    return results
+
+
+def run_copies(copies: List[Tuple[str, str, str]], config: dict):
+    """
+    Copies files given as (sample, source, target), locally or in Batch jobs
+    depending on config['executor']
+    """
+    user_project = config.get('user_project', DEFAULT_USER_PROJECT)
+    if config.get('executor', 'local') != 'batch':
+        for _, src, dst in copies:
+            subprocess.run(copy_command(src, dst, user_project), shell=True, check=True)
+        return
+
+    batch, _ = _new_batch('prep-warp-inputs-copy', config)
+    shards = shard_by_sample(copies, _shard_size(config))
+    for i, shard in enumerate(shards):
+        job = _new_job(batch, config, f'copy-{i}-{len(shard)}-files')
+        job.command('set -e')
+        for _, src, dst in shard:
+            job.command(copy_command(src, dst, user_project))
+    print(f'Copying {len(copies)} files in {len(shards)} jobs')
+    _run_batch(batch)